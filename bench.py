@@ -0,0 +1,216 @@
+"""
+Headless scaling benchmark of the simulation step.
+
+Each size runs in its own process, so JIT compile time and peak memory
+are measured from a cold start for every N. Results are written to a JSON
+file to compare between versions:
+
+    python bench.py --sizes 1000 5000 20000 100000 --output bench.json
+
+Kernels load from the on-disk compile cache when it is warm, pass
+`--cold-cache` to measure the full compile time instead. `--checkpoint`
+starts from a saved (e.g. settled) state instead of a fresh layout, with
+its own number of particules. `--reorder K` sorts the particules by cell
+every K steps (the time it takes is the `reorder` phase, averaged over
+all the steps). `--table RES` reads the pressure gradient from a lookup
+table (see tables.py).
+
+`--pressure implicit` runs the iterative pressure solver; compare it with
+the explicit one through `sim_s_per_wall_s` and `compression` (mean
+density excess over the target, at the end of the run), e.g.
+
+    python bench.py --sizes 5000 --mode dam_break --params gravity=100 --dt 0.033 --pressure implicit
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import platform
+import os
+import resource
+import tempfile
+import tracemalloc
+from datetime import datetime
+from time import perf_counter
+from warnings import filterwarnings
+
+import numba
+import numpy as np
+
+from sweep import parse_grid
+
+filterwarnings("ignore")
+
+
+def timed_step(sim, dt: float) -> dict[str, float]:
+    sim.step(dt)
+    return sim.profiler.last()
+
+
+def run_case(
+    num_particules: int, steps: int, dt: float, mode: str,
+    neighbor_mode: str = "grid", cold_cache: bool = False, checkpoint: str = None,
+    force_mode: str = "gather", reorder_every: int = 0, kernel_table: int = 0,
+    pressure_mode: str = "explicit", values: dict[str, float] = None, sleep_steps: int = 0
+) -> dict:
+    if cold_cache:
+        os.environ["NUMBA_CACHE_DIR"] = tempfile.mkdtemp(prefix="numba-")
+
+    # NOTE: imported here so compile time starts in the worker process
+    start = perf_counter()
+    from simulation import Simulation
+    from checkpoint import load_simulation, restore_checkpoint
+    from params import make_params
+    import_time = perf_counter() - start
+
+    values = values or {}
+    options = {
+        "force_mode": force_mode, "reorder_every": reorder_every,
+        "kernel_table": kernel_table, "pressure_mode": pressure_mode, "sleep_steps": sleep_steps,
+    }
+
+    tracemalloc.start()
+    start = perf_counter()
+    if checkpoint:
+        sim = load_simulation(checkpoint, neighbor_mode=neighbor_mode, **options)
+        num_particules = sim.n_parts
+    else:
+        sim = Simulation(num_particules, mode, neighbor_mode, params=make_params(**values), **options)
+    sim.profiler.enabled = True
+    cold_setup = perf_counter() - start
+
+    # NOTE: the setup also runs (and compiles) the density and force passes
+    start = perf_counter()
+    if checkpoint:
+        restore_checkpoint(sim, checkpoint)
+        for name, value in values.items():
+            sim.params[name] = value
+    else:
+        sim.reset()
+    setup_time = perf_counter() - start
+
+    first = timed_step(sim, dt)
+
+    history = {name: [] for name in first}
+    iterations = 0
+    for _ in range(steps):
+        for name, value in timed_step(sim, dt).items():
+            history.setdefault(name, []).append(value)
+        iterations += sim.solver_iterations
+
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # NOTE: per step, phases that do not run every step (reorder) included
+    steady = {name: float(np.sum(values)) / steps for name, values in history.items()}
+    step_time = sum(steady.values())
+    compile_time = {name: max(first.get(name, 0.0) - steady[name], 0.0) for name in steady}
+    compile_time["setup"] = max(cold_setup - setup_time, 0.0)
+    target = sim.params[0]["target_density"]
+
+    return {
+        "num_particules": num_particules,
+        "steps": steps,
+        "import_s": import_time,
+        "setup_s": setup_time,
+        "compile_s": sum(compile_time.values()),
+        "compile_phases_s": compile_time,
+        "first_step_s": sum(first.values()),
+        "step_s": step_time,
+        "steps_per_s": 1 / step_time if step_time > 0 else None,
+        "sim_s_per_wall_s": dt / step_time if step_time > 0 else None,
+        "compression": float(np.mean(np.maximum(sim.densities - target, 0))) / target,
+        "solver_iterations": iterations / steps,
+        "active_fraction": sim.tracker.active_fraction if sim.tracker else 1.0,
+        "phases_s": steady,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_numpy_mb": peak_traced / 2**20,
+        "finite": bool(np.all(np.isfinite(sim.positions))),
+        "neighbor_rebuild_rate": sim.neighbors.rebuild_rate if sim.neighbors else 1.0,
+        "reorder_every": reorder_every,
+        "kernel_table": kernel_table,
+        "pressure_mode": pressure_mode,
+        "params": values,
+        "sleep_steps": sleep_steps,
+    }
+
+
+def _worker(args: tuple, queue: mp.Queue) -> None:
+    queue.put(run_case(*args))
+
+
+def run(
+    sizes: list[int], steps: int, dt: float, mode: str,
+    neighbor_mode: str = "grid", cold_cache: bool = False, checkpoint: str = None,
+    force_mode: str = "gather", reorder_every: int = 0, kernel_table: int = 0,
+    pressure_mode: str = "explicit", values: dict[str, float] = None, sleep_steps: int = 0
+) -> list[dict]:
+    ctx = mp.get_context("spawn")
+    results = []
+    for num in sizes:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_worker, args=((num, steps, dt, mode, neighbor_mode, cold_cache, checkpoint, force_mode, reorder_every, kernel_table, pressure_mode, values, sleep_steps), queue))
+        proc.start()
+        result = queue.get()
+        proc.join()
+        results.append(result)
+
+        phases = " ".join(f"{k}={v*1000:.2f}" for k, v in result["phases_s"].items())
+        print(
+            f"N={result['num_particules']}: step {result['step_s']*1000:.2f}ms "
+            f"(import {result['import_s']:.2f}s, compile {result['compile_s']:.2f}s, "
+            f"first step {result['first_step_s']*1000:.1f}ms, peak {result['peak_rss_mb']:.0f}MB, "
+            f"rebuilds {result['neighbor_rebuild_rate']:.0%}, {result['sim_s_per_wall_s']:.2f} sim s/s, "
+            f"compression {result['compression']:.1%}, active {result['active_fraction']:.0%}) | {phases}"
+        )
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 5_000, 20_000, 100_000])
+    parser.add_argument("--steps", type=int, default=20, help="steady-state steps after the compile step")
+    parser.add_argument("--dt", type=float, default=0.01)
+    parser.add_argument("--mode", default="random", help="layout passed to create_particules")
+    parser.add_argument("--neighbors", default="grid", choices=("grid", "verlet"))
+    parser.add_argument("--forces", default="gather", choices=("gather", "pairs"))
+    parser.add_argument("--reorder", type=int, default=0, help="sort the particules by cell every K steps (0: never)")
+    parser.add_argument("--table", type=int, default=0, help="resolution of the gradient lookup table (0: analytic)")
+    parser.add_argument("--pressure", default="explicit", choices=("explicit", "implicit"))
+    parser.add_argument("--params", nargs="+", default=[], help="<param>=<value>, fields of params.PARAMS_DTYPE")
+    parser.add_argument("--sleep", type=int, default=0, help="put cells calm for that many steps to sleep (0: never)")
+    parser.add_argument("--cold-cache", action="store_true", help="compile into an empty numba cache")
+    parser.add_argument("--checkpoint", default=None, help="start every run from this checkpoint (ignores --sizes)")
+    parser.add_argument("--output", default="bench.json")
+    args = parser.parse_args()
+
+    values = {name: value[0] for name, value in parse_grid(args.params).items()}
+    sizes = [None] if args.checkpoint else args.sizes
+    results = run(
+        sizes, args.steps, args.dt, args.mode, args.neighbors, args.cold_cache, args.checkpoint,
+        args.forces, args.reorder, args.table, args.pressure, values, args.sleep
+    )
+    report = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "numba": numba.__version__,
+        "threads": numba.get_num_threads(),
+        "dt": args.dt,
+        "mode": args.mode,
+        "neighbors": args.neighbors,
+        "forces": args.forces,
+        "reorder": args.reorder,
+        "table": args.table,
+        "pressure": args.pressure,
+        "sleep": args.sleep,
+        "params": values,
+        "cold_cache": args.cold_cache,
+        "checkpoint": args.checkpoint,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Saved results in {args.output}")
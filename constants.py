@@ -23,6 +23,16 @@ FACTOR_VISCOSITY = 20
 FACTOR_MOUSE = 100_000
 GRAVITY = 0
 
+PHYSICS_DT = 1 / 120 # NOTE: fixed physics timestep (s)
+MAX_SUBSTEPS = 8 # NOTE: max. physics steps per rendered frame
+CFL_NUMBER = 0.4 # NOTE: fraction of SMOOTHING_RADIUS a particule may move per step
+# NOTE: max. accumulation slabs of the pair forces, each one costs N x 4 values to zero and sum per step
+PAIR_CHUNKS = 16
+PRESSURE_TOLERANCE = 0.01 # NOTE: mean compression / TARGET_DENSITY the implicit pressure stops at
+PRESSURE_MAX_ITERATIONS = 50
+SLEEP_SPEED = 1.0 # NOTE: pixels/s under which a particule may fall asleep
+SLEEP_DENSITY_ERROR = 0.1 # NOTE: |density - TARGET_DENSITY| / TARGET_DENSITY, idem
+
 
 TANK = (20, 100, WIN_RES.x-20-20, WIN_RES.y-100-20)
 CENTER_TANK = Vector2(TANK[0] + TANK[2]/2, TANK[1] + TANK[3]/2)
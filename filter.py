@@ -1,19 +1,20 @@
 import numpy as np
 from numba import njit, prange
+import kernel_cache # NOTE: sets the cache folder, before the first @njit
 
 from constants import TANK, SMOOTHING_RADIUS
 START = np.array([TANK[0], TANK[1]]).reshape((1, 2))
 HASH = np.array([15823, 9737333]).reshape((1, 2))
 
-@njit
+@njit(cache=True)
 def pos_to_coord(positions: np.ndarray, radius: float = SMOOTHING_RADIUS) -> np.ndarray:
     return (positions -START)//radius
 
-@njit
+@njit(cache=True)
 def coords_to_hash(coords: np.ndarray) -> np.ndarray:
     return np.sum(coords * HASH, axis=1)
 
-@njit
+@njit(cache=True)
 def positions_to_hash(positions: np.ndarray, radius: float = SMOOTHING_RADIUS) -> np.ndarray:
     return coords_to_hash(pos_to_coord(positions, radius))
 
@@ -25,17 +26,132 @@ CELL_SPACE = np.array([
 ])
 HASH_SPACE = coords_to_hash(CELL_SPACE)
 
-@njit
+@njit(cache=True)
 def get_lookup_space(hash: float) -> np.ndarray:
     return HASH_SPACE + hash
 
-@njit(parallel=True)
+@njit(cache=True)
 def get_indices(hash: float, ref: np.ndarray) -> np.ndarray:
     filter = np.array([False for _ in range(ref.shape[0])])
     lookup_space = get_lookup_space(hash)
 
-    for i in prange(lookup_space.shape[0]):
+    # NOTE: plain range, a prange reduction over `filter` always returned False
+    for i in range(lookup_space.shape[0]):
         value = lookup_space[i]
         filter = filter | (ref == value)
 
-    return filter
\ No newline at end of file
+    return filter
+
+# NOTE: dense cell grid over the tank, used by the sorted cell index
+GRID_MARGIN = 2
+
+def get_grid_shape(radius: float = SMOOTHING_RADIUS) -> tuple[int, int]:
+    return (
+        int(TANK[2]//radius) +1 +2*GRID_MARGIN,
+        int(TANK[3]//radius) +1 +2*GRID_MARGIN
+    )
+
+@njit(nogil=True, cache=True)
+def positions_to_cell(
+    positions: np.ndarray, keys: np.ndarray,
+    nx: int, ny: int, radius: float = SMOOTHING_RADIUS
+) -> np.ndarray:
+    """Same cells as `positions_to_hash`, but clamped to the grid and
+    linearized (`cx + cy * nx`) so they can index a dense table.
+    """
+    for i in range(positions.shape[0]):
+        cx = (positions[i, 0] -START[0, 0])//radius + GRID_MARGIN
+        cy = (positions[i, 1] -START[0, 1])//radius + GRID_MARGIN
+        # NOTE: also catches NaN, particules out of the grid go to the border cells
+        cx = min(max(cx, 0), nx -1) if cx == cx else 0
+        cy = min(max(cy, 0), ny -1) if cy == cy else 0
+        keys[i] = int(cx) + int(cy) * nx
+
+    return keys
+
+@njit(cache=True)
+def cell_span(low: float, high: float, axis: int, n: int, radius: float) -> tuple[int, int]:
+    """First and last cells (clamped to the grid, as `positions_to_cell`)
+    covering [low, high] along `axis` (0: x, 1: y).
+    """
+    c0 = (low -START[0, axis])//radius + GRID_MARGIN
+    c1 = (high -START[0, axis])//radius + GRID_MARGIN
+    return int(min(max(c0, 0), n -1)), int(min(max(c1, 0), n -1))
+
+@njit(nogil=True, cache=True)
+def build_cell_index(keys: np.ndarray, order: np.ndarray, cell_start: np.ndarray) -> None:
+    """Counting sort of the particules by cell key.
+
+    After the call, `order[cell_start[c]:cell_start[c+1]]` are the
+    indices of the particules inside of the cell `c`.
+    """
+    n_cells = cell_start.shape[0] -1
+    cell_start[:] = 0
+    for i in range(keys.shape[0]):
+        cell_start[keys[i] +1] += 1
+
+    for c in range(1, n_cells +1):
+        cell_start[c] += cell_start[c -1]
+
+    # NOTE: after scattering, cell_start[c] holds the end of the cell c
+    for i in range(keys.shape[0]):
+        k = keys[i]
+        order[cell_start[k]] = i
+        cell_start[k] += 1
+
+    for c in range(n_cells, 0, -1):
+        cell_start[c] = cell_start[c -1]
+    cell_start[0] = 0
+
+@njit(parallel=True, nogil=True, cache=True)
+def take_rows(src: np.ndarray, index: np.ndarray, out: np.ndarray) -> None:
+    """`out[i] = src[index[i]]` for 2D arrays (e.g. reorder by `order`)."""
+    for i in prange(index.shape[0]):
+        for c in range(src.shape[1]):
+            out[i, c] = src[index[i], c]
+
+@njit(parallel=True, nogil=True, cache=True)
+def scatter_rows(src: np.ndarray, index: np.ndarray, out: np.ndarray) -> None:
+    """`out[index[i]] = src[i]` for 2D arrays, `index` being a permutation."""
+    for i in prange(index.shape[0]):
+        for c in range(src.shape[1]):
+            out[index[i], c] = src[i, c]
+
+@njit(cache=True)
+def get_row_range(key: int, row: int, cell_start: np.ndarray, nx: int, ny: int) -> tuple[int, int]:
+    """Range of `order` covered by the row `row` (0, 1 or 2) of the 3x3
+    stencil (`CELL_SPACE`) around the cell `key`. Cells in the same row
+    are contiguous, so each row of the stencil is one `(start, end)` range.
+    """
+    cx = key % nx
+    y = key // nx +row -1
+    if y < 0 or y >= ny:
+        return 0, 0
+
+    x0 = max(cx -1, 0)
+    x1 = min(cx +1, nx -1)
+    return cell_start[x0 + y * nx], cell_start[x1 + y * nx +1]
+
+@njit(cache=True)
+def get_neighbor_ranges(key: int, cell_start: np.ndarray, nx: int, ny: int) -> np.ndarray:
+    ranges = np.zeros((3, 2), dtype=np.int64)
+    for r in range(3):
+        ranges[r, 0], ranges[r, 1] = get_row_range(key, r, cell_start, nx, ny)
+
+    return ranges
+
+@njit(cache=True)
+def get_neighbor_indices(key: int, order: np.ndarray, cell_start: np.ndarray, nx: int, ny: int) -> np.ndarray:
+    ranges = get_neighbor_ranges(key, cell_start, nx, ny)
+    total = 0
+    for r in range(3):
+        total += ranges[r, 1] - ranges[r, 0]
+
+    inds = np.empty(total, dtype=np.int64)
+    k = 0
+    for r in range(3):
+        for j in range(ranges[r, 0], ranges[r, 1]):
+            inds[k] = order[j]
+            k += 1
+
+    return inds
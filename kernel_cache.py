@@ -0,0 +1,45 @@
+"""
+Where the compiled kernels are cached on disk (`cache=True`). Numba only
+checks the kernel's own file, but our kernels bake in the values of
+constants.py and inline helpers from other modules. So the cache lives in
+a folder keyed by the sources of the modules compiled into them: any edit
+of one starts from a clean cache, and the folders of older keys are removed.
+
+Every module with kernels imports it before its first `@njit`, the folder
+must be set before numba locates the cache of a kernel.
+"""
+
+from hashlib import sha1
+from os import environ
+from pathlib import Path
+from shutil import rmtree
+
+from numba import config
+
+# NOTE: the modules with kernels, or constants baked into them
+KERNEL_MODULES = (
+    "constants", "params", "filter", "liquid", "solver", "tables",
+    "utils", "sleep", "obstacles", "neighbors", "render",
+)
+ROOT = Path(__file__).parent
+
+
+def cache_key() -> str:
+    sources = b"".join((ROOT / f"{name}.py").read_bytes() for name in KERNEL_MODULES)
+    return sha1(sources).hexdigest()[:12]
+
+
+def set_cache_dir() -> Path:
+    """Point numba to the folder of the current key and remove the others."""
+    folder = ROOT / "__pycache__" / f"numba-{cache_key()}"
+    for old in folder.parent.glob("numba-*"):
+        if old != folder:
+            rmtree(old, ignore_errors=True)
+
+    config.CACHE_DIR = str(folder)
+    return folder
+
+
+# NOTE: bench.py --cold-cache sets its own empty folder
+if not environ.get("NUMBA_CACHE_DIR"):
+    set_cache_dir()
@@ -1,42 +1,80 @@
 import numpy as np
 from numba import njit, jit
+import kernel_cache # NOTE: sets the cache folder, before the first @njit
 
 from constants import *
 
 
-def create_particules(num_particules:int = NUM_PARTICULES, mode:str = "random") -> np.ndarray:
+LAYOUTS = ("random", "grid", "jittered", "dam_break")
+LAYOUT_MARGIN = 10 # NOTE: pixels kept free along the walls of the tank
+DAM_WIDTH = 0.4 # NOTE: fraction of the tank width taken by the dam_break block
+
+
+def fit_grid(num_particules: int, width: float, height: float, spacing: float, max_cols: int = None) -> tuple[int, int, float]:
+    """(columns, rows, spacing) of a grid of `num_particules` inside of
+    `width` x `height`. Up to `max_cols` columns while the rows fit, then as
+    many as fit; the spacing only shrinks when even that doesn't fit.
+    """
+    spacing = min(spacing, np.sqrt(width * height / max(num_particules, 1)))
+    while True:
+        fit = max(int(width // spacing), 1)
+        for cols in (min(fit, max_cols or fit), fit):
+            rows = -(-num_particules // cols)
+            if rows * spacing <= height:
+                return cols, rows, spacing
+        spacing *= 0.99
+
+
+def create_particules(
+    num_particules:int = NUM_PARTICULES, mode:str = "random",
+    rng: np.random.Generator = None, spacing: float = round(RADIUS * 2.5, 0)
+) -> np.ndarray:
     """Function to create the positions of the particules.
     
     `Mode` options:
-        - `random` for random positions inside of the tank
-        - `grid` for equal spacing particules
-    """
-    spacing = round(RADIUS * 2.5, 0)
-    per_row = int(300/RADIUS)
-    n_rows = num_particules//per_row + (1 if num_particules%per_row > 0 else 0)
-    inicial_x = round(CENTER_TANK.x - (per_row -1) * spacing / 2, 0)
-    inicial_y = round(CENTER_TANK.y - n_rows * spacing / 2, 0)
+        - `random` for random positions inside of the tank (drawn from `rng`)
+        - `grid` for equal spacing particules, centered in the tank
+        - `jittered` for the grid moved by up to a quarter of the spacing
+        - `dam_break` for a block against the left wall, filled from the bottom
 
-    positions = np.zeros((num_particules, 2))
-    for i in range(num_particules):
-
-        if mode == "random":
-            pos = np.random.randint(
-                (TANK[0] +10, TANK[1] +10),
-                (TANK[0] +TANK[2] -20, TANK[1] +TANK[3] -20),
-                2
-            )
-
-        elif mode == "grid":
-            pos = (inicial_x + (i%per_row) * spacing, inicial_y + (i//per_row +1) * spacing)
-            pos = np.array(pos).reshape((1, 2))
-
-        positions[i] = pos
+    The grids keep `spacing` while they fit in the tank, shrinking it otherwise.
+    """
+    if mode not in LAYOUTS:
+        raise ValueError(f"mode must be one of {LAYOUTS}, got {mode!r}")
+    if rng is None:
+        rng = np.random.default_rng()
+
+    left, top = TANK[0] + LAYOUT_MARGIN, TANK[1] + LAYOUT_MARGIN
+    width, height = TANK[2] - 2*LAYOUT_MARGIN, TANK[3] - 2*LAYOUT_MARGIN
+
+    if mode == "random":
+        positions = rng.integers(
+            (TANK[0] +10, TANK[1] +10),
+            (TANK[0] +TANK[2] -20, TANK[1] +TANK[3] -20),
+            (num_particules, 2)
+        )
+        return positions.astype(np.float64)
+
+    i = np.arange(num_particules)
+    if mode == "dam_break":
+        cols, rows, spacing = fit_grid(num_particules, width * DAM_WIDTH, height, spacing)
+        x = left + spacing/2 + (i % cols) * spacing
+        y = top + height - spacing/2 - (i // cols) * spacing
+        return np.stack((x, y), axis=-1)
+
+    # NOTE: up to 300/RADIUS per row, as the original layout
+    cols, rows, spacing = fit_grid(num_particules, width, height, spacing, int(300/RADIUS))
+    inicial_x = round(CENTER_TANK.x - (cols -1) * spacing / 2, 0)
+    inicial_y = round(CENTER_TANK.y - rows * spacing / 2, 0)
+    positions = np.stack((inicial_x + (i % cols) * spacing, inicial_y + (i // cols +1) * spacing), axis=-1)
+
+    if mode == "jittered":
+        positions += rng.uniform(-spacing/4, spacing/4, positions.shape)
 
     return positions
 
 
-@njit
+@njit(cache=True)
 def smoothing_kernel(dst: float | np.ndarray) -> float | np.ndarray:
     """Min. value: 0
     Max. value: 6 * R^2 / pi * R^4
@@ -46,7 +84,7 @@ def smoothing_kernel(dst: float | np.ndarray) -> float | np.ndarray:
 
     return (value ** 2) / VOLUME
 
-@njit
+@njit(cache=True)
 def smoothing_kernel_derivative(dst: float | np.ndarray) -> float | np.ndarray:
     """Min. value: (-12) * R (* FACTOR_SLOPE) / pi * R^4
     Max. value: 0
@@ -56,7 +94,7 @@ def smoothing_kernel_derivative(dst: float | np.ndarray) -> float | np.ndarray:
 
     return 2 * value * FACTOR_SLOPE / VOLUME
 
-@njit
+@njit(cache=True)
 def viscosity_smoothing_kernel(dst: float | np.ndarray) -> float | np.ndarray:
     value = (SMOOTHING_RADIUS**2 - dst**2) / PIX_TO_UN**2
     value = np.clip(value, a_min=0, a_max=None)
@@ -64,7 +102,7 @@ def viscosity_smoothing_kernel(dst: float | np.ndarray) -> float | np.ndarray:
     return value**3 #TODO: correct by volume
 
 
-@njit
+@njit(cache=True)
 def calculate_density(positions: np.ndarray, ref: np.ndarray) -> float:
     """Min. value: 0
     Max. value: MAX_DENSITY (approx. XX times the density of one particule)
@@ -77,7 +115,7 @@ def calculate_density(positions: np.ndarray, ref: np.ndarray) -> float:
     return influence * MASS * FACTOR_DENSITY
 
 
-@njit
+@njit(cache=True)
 def density_to_pressure(density: float | np.ndarray, factor: float = FACTOR_PRESSURE) -> float | np.ndarray:
     """Min. value: -TARGET_DENSITY * FACTOR_PRESSURE
     Max. value: approx. (MAX_DENSITY -TARGET_DENSITY) * FACTOR_PRESSURE
@@ -85,7 +123,7 @@ def density_to_pressure(density: float | np.ndarray, factor: float = FACTOR_PRES
     return np.abs(density - TARGET_DENSITY) * factor
 
 
-@njit
+@njit(cache=True)
 def calculate_pressure_force(
     positions: np.ndarray, densities: np.ndarray,
     ref_pos: np.ndarray, ref_dens: float,
@@ -121,7 +159,7 @@ def calculate_pressure_force(
 
     return np.sum(influences, axis=0) * MASS * 100
 
-@njit
+@njit(cache=True)
 def exemple_func(pos: np.ndarray) -> np.ndarray:
     """Function to test the gradient
     Min. value: -1
@@ -131,7 +169,7 @@ def exemple_func(pos: np.ndarray) -> np.ndarray:
 
     return np.cos((pos[:, 1] / PIX_TO_UN) -3 + np.sin(pos[:, 0] / PIX_TO_UN))
 
-@njit
+@njit(cache=True)
 def calculate_exemple(positions: np.ndarray, densities:np.ndarray, ref: np.ndarray) -> np.ndarray:
     """Function to test the gradient
     Min. value: -1
@@ -147,7 +185,7 @@ def calculate_exemple(positions: np.ndarray, densities:np.ndarray, ref: np.ndarr
     return influence * MASS
 
 
-@njit
+@njit(cache=True)
 def calculate_exemple_gradient(
     positions: np.ndarray, densities: np.ndarray,
     ref_pos: np.ndarray
@@ -173,7 +211,7 @@ def calculate_exemple_gradient(
 
     return np.sum(influences, axis=0) * MASS * 20_000
 
-@njit
+@njit(nogil=True, cache=True)
 def calculate_mouse_force(
     mouse_pos:np.ndarray, positions:np.ndarray,
     vels:np.ndarray, rad:float, strength:float
@@ -189,7 +227,7 @@ def calculate_mouse_force(
 
     return force
 
-@njit
+@njit(cache=True)
 def calculate_viscosity_force(
     positions: np.ndarray, vels: np.ndarray,
     ref_pos: np.ndarray, ref_vel: float,
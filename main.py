@@ -2,23 +2,50 @@
 Pygame stuffs: create window, handle events and updating frames
 """
 
+from time import perf_counter
+LAUNCH_TIME = perf_counter()
+
 import pygame as pg
 import numpy as np
-from numba import jit, prange
+import numba
+from numba import prange
 
 from warnings import filterwarnings
+import argparse
+import os
 import sys
+from contextlib import contextmanager, nullcontext
 
 from constants import *
 from utils import *
 from liquid import *
 from filter import *
+from simulation import Simulation, warm_up
+from obstacles import ObstacleField
+from scheduler import FixedStepScheduler
+from recorder import TrajectoryRecorder, Trajectory
+from checkpoint import save_checkpoint, restore_checkpoint, read_checkpoint
+from pipeline import SimulationThread
+from render import *
+from solver import sample_densities, sample_pressure_forces
 
 filterwarnings("ignore")
+IMPORT_TIME = perf_counter() - LAUNCH_TIME
+
+COLOR_MODES = ("water", "density", "speed")
+WATER_COLOR = np.array([COLOR_WATER[:3]], dtype=np.uint8)
 
 class Engine:
 
-    def __init__(self, num_particules: int = NUM_PARTICULES):
+    def __init__(
+        self, num_particules: int = NUM_PARTICULES,
+        recorder: TrajectoryRecorder = None, playback: Trajectory = None,
+        checkpoint: str = "checkpoint.sph", threaded: bool = False, mode: str = "grid",
+        sleep_steps: int = 0, obstacles: ObstacleField = None
+    ):
+        if playback is not None:
+            num_particules = playback.num_particules
+
         pg.init()
         self.font = pg.font.SysFont(None, 15)
         self.screen = pg.display.set_mode(WIN_RES, flags = pg.DOUBLEBUF)
@@ -28,87 +55,142 @@ class Engine:
         self.is_running = False
         self.show_bg_color = False
         self.show_gradient = False
+        self.show_profiler = False
+        self.color_mode = COLOR_MODES[0]
 
         self.mouse_value = 0
         self.mouse_radius = 50
 
         self.clock = pg.time.Clock()
         self.delta_time = 0.1
-        self.time = 0
-
-        self.n_parts = num_particules
-        self.positions: np.ndarray = None
-        self.pred_pos: np.ndarray = None
-        self.hashes: np.ndarray = None
-
-        self.velocities: np.ndarray = None
-        self.densities: np.ndarray = None
-        self.pressures: np.ndarray = None
-        self.viscosities: np.ndarray = None
-        self.mouse_force: np.ndarray = None
-        self.inicial_setup()
-
-    def inicial_setup(self):
-        self.positions = create_particules(self.n_parts, "grid")
-        self.pred_pos = np.zeros((self.n_parts, 2), dtype=np.float32)
-        self.velocities = np.zeros((self.n_parts, 2), dtype=np.float32)
-        self.densities = np.zeros((self.n_parts,), dtype=np.float32)
-        self.pressures = np.zeros((self.n_parts, 2), dtype=np.float32)
-        self.viscosities = np.zeros((self.n_parts, 2), dtype=np.float32)
-        self.mouse_force = np.zeros((self.n_parts, 2), dtype=np.float32)
-
-        self.update_predictions()
-        self.update_densities()
-        self.update_pressures()
-        self.update_viscosities()
+
+        # NOTE: what the simulation runs with, warm_up compiles the same kernels
+        self.options = {"sleep_steps": sleep_steps, "obstacles": obstacles}
+        self.sim = Simulation(num_particules, mode, **self.options)
+        self.scheduler = FixedStepScheduler()
+        self.profiler = self.sim.profiler
+        self.colors = np.zeros((num_particules, 3), dtype=np.uint8)
+
+        # NOTE: outline of the obstacles, drawn once in place of the tank
+        self.obstacle_surface: pg.Surface = None
+        if obstacles is not None:
+            outline = obstacles.outline()
+            colors = np.zeros((*outline.shape, 3), dtype=np.uint8)
+            colors[outline] = COLOR_TANK
+            surface = pg.surfarray.make_surface(colors)
+            surface.set_colorkey((0, 0, 0))
+            self.obstacle_surface = pg.transform.scale(
+                surface, (round(outline.shape[0] * obstacles.cell), round(outline.shape[1] * obstacles.cell))
+            )
+
+        # NOTE: background density field on a coarse grid
+        self.field_points, self.field_shape = get_field_points()
+        self.field_keys = np.zeros(self.field_points.shape[0], dtype=np.int64)
+        self.field_values = np.zeros(self.field_points.shape[0])
+        self.field_colors = np.zeros((self.field_points.shape[0], 3), dtype=np.uint8)
+        self.field_surface = pg.Surface(self.field_shape)
+        self.field_scaled = pg.Surface((self.field_shape[0] * FIELD_STEP, self.field_shape[1] * FIELD_STEP))
+
+        # NOTE: pressure gradient arrows
+        self.arrow_points = get_arrow_points()
+        self.arrow_keys = np.zeros(self.arrow_points.shape[0], dtype=np.int64)
+        self.arrow_ends = np.zeros(self.arrow_points.shape)
+
+        # NOTE: recording of the run, or playback of one (no physics)
+        self.recorder = recorder
+        self.playback = playback
+        self.play_frame = 0
+        self.play_time = 0.0
+        if playback is not None:
+            self.load_frame(0)
+
+        # NOTE: saved with S and restored with L
+        self.checkpoint = checkpoint
+
+        # NOTE: pipelined mode, the physics steps on its own thread
+        self.runner: SimulationThread = None
+        if threaded and playback is None:
+            self.runner = SimulationThread(self.sim, self.scheduler, recorder)
+
+    def warm_up(self) -> float:
+        """Compile (or load from the cache) every kernel the first frames
+        use, drawing all the overlays and color modes once.
+        """
+        start = perf_counter()
+        warm_up(self.sim.dtype, self.sim.neighbor_mode, **self.options)
+
+        flags = self.show_bg_color, self.show_gradient, self.color_mode
+        self.show_bg_color = self.show_gradient = True
+        for mode in COLOR_MODES:
+            self.color_mode = mode
+            self.render()
+        self.show_bg_color, self.show_gradient, self.color_mode = flags
+
+        return perf_counter() - start
+
+    def startup_report(self) -> dict[str, float]:
+        """Import, compile and first (full size) step times, in seconds."""
+        compile_time = self.warm_up()
+
+        # NOTE: dt = 0 runs every kernel without moving the particules, the
+        # collision would still move a played back frame: no step there
+        first_step = 0.0
+        if self.playback is None:
+            start = perf_counter()
+            self.sim.step(0.0)
+            first_step = perf_counter() - start
+
+        return {"import": IMPORT_TIME, "compile": compile_time, "first_step": first_step}
+
+    @contextmanager
+    def frame(self):
+        """What to draw: the simulation itself, or the last frame published
+        by the simulation thread.
+        """
+        if self.runner is None:
+            yield self.sim
+            return
+
+        with self.runner.read() as frame:
+            if self.show_bg_color or self.show_gradient:
+                frame.update_index()
+            yield frame
+
+    def paused(self):
+        """The simulation, not stepping while inside of the block."""
+        return nullcontext(self.sim) if self.runner is None else self.runner.paused()
 
     # @jit(parallel=True)
     def render(self):
+        with self.frame() as view:
+            self.draw(view)
+
+    def draw(self, sim):
+        profile = self.profiler.section
         self.screen.fill(COLOR_BG)
         
         # NOTE: background color
         if self.show_bg_color:
-            for y in range(int(TANK[1]), int(TANK[1] +TANK[3]-4), 5):
-                for x in prange(int(TANK[0]), int(TANK[0] +TANK[2]-4), 5):
-                    pos = np.array((x+3, y+3))
-                    d = calculate_density(self.positions, pos)
-                    d = (self.densities + d)/2
-                    d = d.mean()
-                    # exemp = calculate_exemple(self.positions, self.densities, pos)
-
-                    col = get_density_color(d)
-                    # col = get_exemple_color(exemp*1.5)
-                    pg.draw.rect(self.screen, col, (x, y, 5, 5))
+            with profile("background"):
+                self.draw_density_field(sim)
 
         # NOTE: visualizing gradient direction
         if self.show_gradient:
-            inc = PIX_TO_UN//2 +1 -5
-            for y in range(int(TANK[1]), int(TANK[1] +TANK[3]), PIX_TO_UN):
-                for x in prange(int(TANK[0]), int(TANK[0] +TANK[2]-PIX_TO_UN+1), PIX_TO_UN):
-                    pos = np.array((x +inc, y +inc)).reshape((1, 2))
-
-                    d = calculate_density(self.pred_pos, pos)
-                    p = calculate_pressure_force(self.pred_pos, self.densities, pos, d)
-                    # grad = calculate_exemple_gradient(self.positions, self.densities, pos)
-
-                    end = pos.ravel() + (p/7_000)
-                    # end = pos.ravel() + grad
-                    pg.draw.circle(self.screen, (210,210,15), (x +inc, y +inc), 4)
-                    pg.draw.line(self.screen, (210,210,15), (x +inc, y +inc), end, 3)
+            with profile("gradient"):
+                self.draw_gradient(sim)
 
         # NOTE: particules
-        # tank = pg.Surface((TANK[2], TANK[3])).convert_alpha()
-        for i in prange(self.n_parts):
-            pos = self.positions[i]
-
-            # alpha_surf = pg.Surface((2*SMOOTHING_RADIUS, 2*SMOOTHING_RADIUS)).convert_alpha()
-            # alpha_surf.fill((0, 0, 0, 0))
-            # # col = get_exemple_color(exemple_func(pos))
-            # draw_smooth_circle(alpha_surf, COLOR_WATER)
-            # blit_pos = pos -SMOOTHING_RADIUS -np.array([TANK[0], TANK[1]])
-            # tank.blit(alpha_surf, blit_pos)
+        with profile("particules"):
+            if self.color_mode == "density":
+                colors = density_colors(sim.densities, sim.params, self.colors)
+            elif self.color_mode == "speed":
+                colors = speed_colors(sim.velocities, self.colors)
+            else:
+                colors = WATER_COLOR
 
-            pg.draw.circle(self.screen, COLOR_WATER, pos, RADIUS, 2)
+            pixels = pg.surfarray.pixels3d(self.screen)
+            rasterize_particules(pixels, sim.positions, colors)
+            del pixels
 
         # mouse = np.array(pg.mouse.get_pos()).reshape((1, 2))
         # space = get_lookup_space(positions_to_hash(mouse, 30)[0])
@@ -122,34 +204,70 @@ class Engine:
         
         # self.screen.blit(tank, (TANK[0], TANK[1]))
         pg.draw.circle(self.screen, "red", pg.mouse.get_pos(), self.mouse_radius, 1)
-        pg.draw.rect(self.screen, COLOR_TANK, TANK, 1)
+        if self.obstacle_surface is None:
+            pg.draw.rect(self.screen, COLOR_TANK, TANK, 1)
+        else:
+            self.screen.blit(self.obstacle_surface, (0, 0))
+
+        with profile("text"):
+            self.draw_text(sim)
+            if self.show_profiler: self.draw_profiler()
+
+        with profile("flip"):
+            pg.display.flip()
+
+    def draw_density_field(self, sim):
+        positions_to_cell(self.field_points, self.field_keys, *sim.grid_shape, sim.cell_radius)
+        sample_densities(
+            self.field_points, self.field_keys, sim.pred_pos,
+            sim.cell_order, sim.cell_start, *sim.grid_shape, sim.params, self.field_values
+        )
+        # NOTE: blended with the mean density, as the per-block version did
+        self.field_values += sim.densities.mean()
+        self.field_values /= 2
+
+        density_colors(self.field_values, sim.params, self.field_colors)
+        pg.surfarray.blit_array(self.field_surface, self.field_colors.reshape((*self.field_shape, 3)))
+        pg.transform.scale(self.field_surface, self.field_scaled.get_size(), self.field_scaled)
+        self.screen.blit(self.field_scaled, (TANK[0], TANK[1]))
+
+    def draw_gradient(self, sim):
+        positions_to_cell(self.arrow_points, self.arrow_keys, *sim.grid_shape, sim.cell_radius)
+        sample_pressure_forces(
+            self.arrow_points, self.arrow_keys, sim.pred_pos, sim.densities,
+            sim.cell_order, sim.cell_start, *sim.grid_shape, sim.params, self.arrow_ends
+        )
+        self.arrow_ends *= ARROW_SCALE
+        self.arrow_ends += self.arrow_points
 
-        self.draw_text()
-        pg.display.flip()
+        pixels = pg.surfarray.pixels3d(self.screen)
+        rasterize_arrows(pixels, self.arrow_points, self.arrow_ends, ARROW_COLOR)
+        del pixels
 
-    def draw_text(self):
+    def draw_text(self, sim):
         # bloco 1
         fps = self.font.render(f"FPS: {self.clock.get_fps():.0f}", True, "white")
         dt = self.font.render(f"Delta time: {self.delta_time:.2f}", True, "white")
-        t = self.font.render(f"Passed Time: {self.time:.2f}", True, "white")
+        t = self.font.render(f"Passed Time: {sim.time:.2f}", True, "white")
 
         self.screen.blit(fps, (20, 15))
         self.screen.blit(dt, (20, 30))
         self.screen.blit(t, (20, 45))
 
         # bloco 2
-        num = self.font.render(f"N. Particules: {self.n_parts}", True, "white")
-        m = self.font.render(f"Mass: {MASS:.1f}", True, "white")
-        sr = self.font.render(f"Smooth Radius: {SMOOTHING_RADIUS:.0f}", True, "white")
+        params = sim.params[0]
+        num = self.font.render(f"N. Particules: {sim.n_parts}", True, "white")
+        m = self.font.render(f"Mass: {params['mass']:.1f}", True, "white")
+        sr = self.font.render(f"Smooth Radius: {params['smoothing_radius']:.0f}", True, "white")
 
         self.screen.blit(num, (130, 15))
         self.screen.blit(m, (130, 30))
         self.screen.blit(sr, (130, 45))
 
         # bloco 3
-        g = self.font.render(f"Gravity: {GRAVITY:.0f}", True, "white")
-        p = self.font.render(f"Pressure: {FACTOR_PRESSURE:.1f}", True, "white")
-        v = self.font.render(f"Viscosity: {FACTOR_VISCOSITY:.1f}", True, "white")
+        g = self.font.render(f"Gravity: {params['gravity']:.0f}", True, "white")
+        p = self.font.render(f"Pressure: {params['factor_pressure']:.1f}", True, "white")
+        v = self.font.render(f"Viscosity: {params['factor_viscosity']:.1f}", True, "white")
         
         self.screen.blit(g, (240, 15))
         self.screen.blit(p, (240, 30))
@@ -157,8 +275,8 @@ class Engine:
 
         # bloco 4
         d1 = self.font.render(f"Density 1P: {DENSITY_ONE_UNITY:.1f}", True, "white")
-        td = self.font.render(f"T. density: {TARGET_DENSITY:.1f}", True, "white")
-        md = self.font.render(f"M. density: {self.densities.mean():.1f}", True, "white")
+        td = self.font.render(f"T. density: {params['target_density']:.1f}", True, "white")
+        md = self.font.render(f"M. density: {sim.densities.mean():.1f}", True, "white")
         
         self.screen.blit(d1, (350, 15))
         self.screen.blit(td, (350, 30))
@@ -173,90 +291,88 @@ class Engine:
         self.screen.blit(color, (460, 30))
         self.screen.blit(grad, (460, 45))
 
-    @jit
+        # bloco 6
+        prof = self.font.render(f"Profiler: {self.show_profiler}", True, "white")
+        mode = self.font.render(f"Colors: {self.color_mode}", True, "white")
+        steps = self.font.render(
+            f"Steps/s: {self.scheduler.steps_per_second:.0f} ({self.scheduler.last_substeps}x"
+            f"{' adapt.' if self.scheduler.adaptive else ''})", True, "white"
+        )
+        self.screen.blit(prof, (570, 15))
+        self.screen.blit(mode, (570, 30))
+        self.screen.blit(steps, (570, 45))
+
+        # bloco 7
+        if self.playback is not None:
+            frame = self.font.render(f"Frame: {self.play_frame +1}/{len(self.playback)}", True, "white")
+            self.screen.blit(frame, (680, 15))
+        elif self.recorder is not None:
+            rec = self.font.render(f"Rec: {self.recorder.frames}/{self.recorder.max_frames}", True, "white")
+            drop = self.font.render(f"Dropped: {self.recorder.dropped}", True, "white")
+            self.screen.blit(rec, (680, 15))
+            self.screen.blit(drop, (680, 30))
+        if self.runner is not None:
+            pipe = self.font.render(f"Pipelined: {self.runner.published} frames", True, "white")
+            self.screen.blit(pipe, (680, 45))
+        if self.sim.tracker is not None:
+            active = self.font.render(f"Active: {self.sim.tracker.active_fraction:.0%}", True, "white")
+            self.screen.blit(active, (680, 60))
+
+    def draw_profiler(self):
+        x, y = WIN_RES.x - 150, TANK[1] + 10
+        total = 0
+        for name, value in self.profiler.summary().items():
+            total += value
+            text = self.font.render(f"{name}: {value*1000:.2f} ms", True, "white")
+            self.screen.blit(text, (x, y))
+            y += 12
+
+        text = self.font.render(f"total: {total*1000:.2f} ms", True, "white")
+        self.screen.blit(text, (x, y +4))
+
+    def load_frame(self, i: int):
+        """Show frame `i` of the playback. Only the cell index (and the
+        densities, when not recorded) is rebuilt, for the overlays.
+        """
+        self.play_frame = min(max(i, 0), len(self.playback) -1)
+        frame = self.playback.frame(self.play_frame)
+        for name, values in frame.items():
+            getattr(self.sim, name)[:] = values
+        self.sim.time = float(self.playback.times[self.play_frame])
+        self.play_time = self.sim.time
+
+        self.sim.pred_pos[:] = self.sim.positions
+        self.sim.update_index()
+        if "densities" not in frame:
+            self.sim.update_densities()
+
     def update(self):
         self.delta_time = self.clock.tick() * 0.001
 
-        if self.is_running:
-            self.time += self.delta_time
-            
-            # TODO: too slow, find another way?
-            self.update_predictions()
-            self.update_densities()
-            self.update_pressures()
-            self.update_viscosities()
-            if self.mouse_value != 0: self.update_mouse_force()
-            self.update_velocities()
-
-            self.positions += self.velocities * self.delta_time
-            self.positions, self.velocities = tank_collision(self.positions, self.velocities)
-
-    @jit(parallel=True)
-    def update_densities(self):
-        for i in prange(self.n_parts):
-            pos = self.pred_pos[i:i+1, :]
-            
-            hash_pos = positions_to_hash(pos)
-            inds = get_indices(hash_pos, self.hashes)
-
-            density = calculate_density(self.pred_pos[inds], pos)
-            self.densities[i] = density
-
-    @jit(parallel=True)
-    def update_pressures(self):
-        for i in prange(self.n_parts):
-            pos = self.pred_pos[i:i+1, :]
-            dens = self.densities[i]
-
-            hash_pos = positions_to_hash(pos)
-            inds = get_indices(hash_pos, self.hashes)
-
-            pressure = calculate_pressure_force(
-                self.pred_pos[inds], self.densities[inds],
-                pos, dens, FACTOR_PRESSURE
-            )
-            self.pressures[i] = pressure
-
-    @jit(parallel=True)
-    def update_viscosities(self):
-        for i in prange(self.n_parts):
-            pos = self.pred_pos[i:i+1, :]
-            vel = self.velocities[i:i+1, :]
-
-            hash_pos = positions_to_hash(pos)
-            inds = get_indices(hash_pos, self.hashes)
-
-            viscosity = calculate_viscosity_force(
-                self.pred_pos[inds], self.velocities[inds],
-                pos, vel, FACTOR_VISCOSITY
-            )
-            self.viscosities[i] = viscosity        
-
-    @jit(parallel=True)
-    def update_mouse_force(self):
-        mouse_pos = np.array(pg.mouse.get_pos()).reshape((1, 2))
-    
-        self.mouse_force = calculate_mouse_force(
-            mouse_pos, self.pred_pos, self.velocities,
-            self.mouse_radius, self.mouse_value
-        )
+        if self.playback is not None:
+            if self.is_running:
+                play_time = self.play_time + self.delta_time
+                frame = self.playback.frame_at(play_time)
+                if frame != self.play_frame:
+                    self.load_frame(frame)
+                self.play_time = play_time
+                self.is_running = self.play_frame < len(self.playback) -1
+            return
+
+        if self.runner is not None:
+            self.runner.set_mouse(pg.mouse.get_pos(), self.mouse_value, self.mouse_radius)
+            self.runner.set_running(self.is_running)
+            return
 
-    @jit(parallel=True)
-    def update_velocities(self):
-        density = np.stack((self.densities, self.densities), axis=1)
-        self.velocities[:, 1] += GRAVITY * self.delta_time
-        self.velocities += self.pressures * self.delta_time / density
-        self.velocities += self.viscosities * self.delta_time / density
-        self.velocities += self.mouse_force * self.delta_time / density
-
-    @jit(parallel=True)
-    def update_predictions(self):
-        self.pred_pos = self.positions + (self.velocities * self.delta_time)
-        self.hashes = positions_to_hash(self.pred_pos)
+        if self.is_running:
+            self.sim.mouse_pos[0] = pg.mouse.get_pos()
+            self.sim.mouse_value = self.mouse_value
+            self.sim.mouse_radius = self.mouse_radius
+            substeps = self.scheduler.advance(self.sim, self.delta_time)
+            if self.recorder is not None and substeps:
+                self.recorder.record(self.sim)
 
     def handle_events(self):
-        global GRAVITY, FACTOR_PRESSURE
-
         for event in pg.event.get():
             if event.type == pg.QUIT:
                 self.is_executing = False
@@ -267,7 +383,6 @@ class Engine:
                 elif event.button == 3: self.mouse_value = -FACTOR_MOUSE
 
             elif event.type == pg.MOUSEBUTTONUP:
-                self.mouse_force = np.zeros((self.n_parts, 2), dtype=np.float32)
                 pg.mouse.set_visible(True)
                 self.mouse_value = 0
 
@@ -276,19 +391,51 @@ class Engine:
                 else:
                     self.mouse_radius -= 2
 
+            elif event.type == pg.KEYDOWN and self.playback is not None:
+                # NOTE: playback, the arrows scrub through the frames
+                if event.key == pg.K_RIGHT: self.load_frame(self.play_frame +1)
+                elif event.key == pg.K_LEFT: self.load_frame(self.play_frame -1)
+                elif event.key == pg.K_UP: self.load_frame(self.play_frame +30)
+                elif event.key == pg.K_DOWN: self.load_frame(self.play_frame -30)
+                elif event.key == pg.K_RETURN: self.load_frame(0)
+                elif event.key == pg.K_SPACE: self.is_running = not self.is_running
+
+                if event.key == pg.K_c: self.show_bg_color = not self.show_bg_color
+                if event.key == pg.K_BACKSPACE: self.show_gradient = not self.show_gradient
+                if event.key == pg.K_v:
+                    i = COLOR_MODES.index(self.color_mode)
+                    self.color_mode = COLOR_MODES[(i +1) % len(COLOR_MODES)]
+
             elif event.type == pg.KEYDOWN:
-                if event.key == pg.K_UP: GRAVITY += 1
-                elif event.key == pg.K_DOWN: GRAVITY -= 1
+                if event.key == pg.K_UP: self.sim.params["gravity"] += 1
+                elif event.key == pg.K_DOWN: self.sim.params["gravity"] -= 1
 
-                if event.key == pg.K_RIGHT: FACTOR_PRESSURE += 1
-                elif event.key == pg.K_LEFT: FACTOR_PRESSURE -= 1
+                if event.key == pg.K_RIGHT: self.sim.params["factor_pressure"] += 1
+                elif event.key == pg.K_LEFT: self.sim.params["factor_pressure"] -= 1
 
                 if event.key == pg.K_SPACE:
                     self.is_running = not self.is_running
 
                 if event.key == pg.K_RETURN:
-                    self.time = 0
-                    self.inicial_setup()
+                    with self.paused() as sim:
+                        sim.reset()
+                        self.scheduler.reset()
+
+                if event.key == pg.K_s:
+                    with self.paused() as sim:
+                        save_checkpoint(sim, self.checkpoint)
+                    print(f"Saved checkpoint in {self.checkpoint}")
+
+                if event.key == pg.K_l:
+                    try:
+                        with self.paused() as sim:
+                            restore_checkpoint(sim, self.checkpoint)
+                            self.scheduler.reset()
+                    except (OSError, ValueError) as e:
+                        print(f"Could not restore {self.checkpoint}: {e}")
+
+                if event.key == pg.K_a:
+                    self.scheduler.adaptive = not self.scheduler.adaptive
 
                 if event.key == pg.K_c:
                     self.show_bg_color = not self.show_bg_color
@@ -296,20 +443,92 @@ class Engine:
                 if event.key == pg.K_BACKSPACE:
                     self.show_gradient = not self.show_gradient
 
+                if event.key == pg.K_v:
+                    i = COLOR_MODES.index(self.color_mode)
+                    self.color_mode = COLOR_MODES[(i +1) % len(COLOR_MODES)]
+
+                if event.key == pg.K_p:
+                    self.show_profiler = not self.show_profiler
+                    self.profiler.enabled = self.show_profiler
+                    self.profiler.clear()
+
             else:
                 if hasattr(event, "key"):
                     print(f'Type: {pg.event.event_name(event.type)} - key: {pg.key.name(event.key)}')
 
     def run(self):
+        if self.runner is not None:
+            self.runner.publish()
+            self.runner.start()
+
         while self.is_executing:
-            self.handle_events()
+            with self.profiler.section("events"):
+                self.handle_events()
             self.update()
             self.render()
 
+        if self.runner is not None:
+            self.runner.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+            print(f"Recorded {self.recorder.frames} frames in {self.recorder.path}")
         pg.quit()
         sys.exit()
 
 
 if __name__ == "__main__":
-    app = Engine()
+    parser = argparse.ArgumentParser(description="Fluid Simulator")
+    parser.add_argument("--num", type=int, default=NUM_PARTICULES, help="number of particules")
+    parser.add_argument("--mode", default="grid", choices=LAYOUTS, help="inicial layout of the particules")
+    parser.add_argument("--record", metavar="DIR", help="record the run into DIR")
+    parser.add_argument("--frames", type=int, default=3_600, help="max. recorded frames")
+    parser.add_argument(
+        "--fields", nargs="+", default=["positions"],
+        help="recorded fields, e.g. positions velocities densities"
+    )
+    parser.add_argument("--play", metavar="DIR", help="play back a recording (no physics)")
+    parser.add_argument(
+        "--threaded", action="store_true",
+        help="step the simulation on its own thread, the display shows the last finished step"
+    )
+    parser.add_argument(
+        "--checkpoint", metavar="FILE",
+        help="start from FILE if it exists, and save (S) / restore (L) with it instead of checkpoint.sph"
+    )
+    parser.add_argument(
+        "--sleep", type=int, default=0, metavar="STEPS",
+        help="put cells calm for STEPS steps to sleep (0: never)"
+    )
+    parser.add_argument(
+        "--obstacles", metavar="FILE",
+        help="collide with the shapes of FILE instead of the tank (see obstacles.py)"
+    )
+    args = parser.parse_args()
+
+    resume = args.checkpoint and os.path.exists(args.checkpoint) and not args.play
+    if resume:
+        args.num = read_checkpoint(args.checkpoint)[0]["num_particules"]
+
+    recorder = playback = None
+    if args.play:
+        playback = Trajectory(args.play)
+    elif args.record:
+        recorder = TrajectoryRecorder(args.record, args.num, args.frames, tuple(args.fields))
+
+    if args.threaded:
+        # NOTE: both threads launch parallel kernels, the default layer may not allow it
+        numba.config.THREADING_LAYER = "threadsafe"
+
+    obstacles = ObstacleField.load(args.obstacles) if args.obstacles else None
+    app = Engine(
+        args.num, recorder, playback, args.checkpoint or "checkpoint.sph",
+        args.threaded, args.mode, args.sleep, obstacles
+    )
+    if resume:
+        restore_checkpoint(app.sim, args.checkpoint)
+    report = app.startup_report()
+    print(
+        f"Startup: import {report['import']:.2f}s, compile {report['compile']:.2f}s, "
+        f"first step {report['first_step']*1000:.1f}ms"
+    )
     app.run()
\ No newline at end of file
@@ -0,0 +1,111 @@
+"""
+Verlet neighbor lists: for each particule, the neighbors inside of
+SMOOTHING_RADIUS + skin, stored as CSR (`offsets`, `indices`). The lists
+stay valid while no particule moved more than skin/2 since the last build.
+"""
+
+import numpy as np
+from numba import njit, prange
+import kernel_cache # NOTE: sets the cache folder, before the first @njit
+
+from constants import SMOOTHING_RADIUS
+from filter import get_row_range
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def count_neighbors(
+    positions: np.ndarray, keys: np.ndarray, order: np.ndarray,
+    cell_start: np.ndarray, nx: int, ny: int, radius: float, counts: np.ndarray
+) -> None:
+    r2 = radius * radius
+    for i in prange(positions.shape[0]):
+        x, y = positions[i, 0], positions[i, 1]
+        c = 0
+        for r in range(3):
+            start, end = get_row_range(keys[i], r, cell_start, nx, ny)
+            for k in range(start, end):
+                j = order[k]
+                dx = positions[j, 0] - x
+                dy = positions[j, 1] - y
+                if dx*dx + dy*dy <= r2:
+                    c += 1
+
+        counts[i] = c
+
+@njit(parallel=True, nogil=True, cache=True)
+def fill_neighbors(
+    positions: np.ndarray, keys: np.ndarray, order: np.ndarray,
+    cell_start: np.ndarray, nx: int, ny: int, radius: float,
+    offsets: np.ndarray, indices: np.ndarray
+) -> None:
+    r2 = radius * radius
+    for i in prange(positions.shape[0]):
+        x, y = positions[i, 0], positions[i, 1]
+        c = offsets[i]
+        for r in range(3):
+            start, end = get_row_range(keys[i], r, cell_start, nx, ny)
+            for k in range(start, end):
+                j = order[k]
+                dx = positions[j, 0] - x
+                dy = positions[j, 1] - y
+                if dx*dx + dy*dy <= r2:
+                    indices[c] = j
+                    c += 1
+
+@njit(parallel=True, nogil=True, cache=True)
+def max_displacement(positions: np.ndarray, ref: np.ndarray) -> float:
+    value = 0.0
+    for i in prange(positions.shape[0]):
+        dx = positions[i, 0] - ref[i, 0]
+        dy = positions[i, 1] - ref[i, 1]
+        value = max(value, dx*dx + dy*dy)
+
+    return np.sqrt(value)
+
+
+class NeighborList:
+
+    def __init__(self, num_particules: int, skin: float = SMOOTHING_RADIUS / 2, dtype: np.dtype = np.float32):
+        self.skin = skin
+        self.radius = SMOOTHING_RADIUS + skin
+
+        self.offsets = np.zeros((num_particules +1,), dtype=np.int64)
+        self.counts = np.zeros((num_particules,), dtype=np.int64)
+        self.indices = np.zeros((num_particules * 16,), dtype=np.int64)
+        self.ref_positions = np.zeros((num_particules, 2), dtype=dtype)
+
+        # NOTE: rebuild statistics
+        self.builds = 0
+        self.checks = 0
+        self.is_valid = False
+
+    @property
+    def rebuild_rate(self) -> float:
+        return self.builds / self.checks if self.checks else 0.0
+
+    def invalidate(self):
+        self.is_valid = False
+
+    def needs_rebuild(self, positions: np.ndarray) -> bool:
+        self.checks += 1
+        if not self.is_valid:
+            return True
+
+        return not max_displacement(positions, self.ref_positions) <= self.skin / 2
+
+    def build(
+        self, positions: np.ndarray, keys: np.ndarray, order: np.ndarray,
+        cell_start: np.ndarray, nx: int, ny: int
+    ):
+        """The cell index must have cells of at least `self.radius`."""
+        count_neighbors(positions, keys, order, cell_start, nx, ny, self.radius, self.counts)
+        np.cumsum(self.counts, out=self.offsets[1:])
+
+        total = self.offsets[-1]
+        if total > self.indices.shape[0]:
+            self.indices = np.zeros((int(total * 1.5),), dtype=np.int64)
+
+        fill_neighbors(positions, keys, order, cell_start, nx, ny, self.radius, self.offsets, self.indices)
+        self.ref_positions[:] = positions
+        self.builds += 1
+        self.is_valid = True
@@ -0,0 +1,285 @@
+"""
+Static obstacles and containers, as a signed distance field. The shapes
+are read from a text file, one per line (pixels, `#` starts a comment):
+
+    circle  x y radius
+    box     x y width height
+    polygon x1 y1 x2 y2 x3 y3 ...
+    container box 20 100 1060 480      # the liquid stays inside of it
+
+They are rasterized once into a grid of distances to the nearest solid
+(negative inside of one) and their unit gradients, so the collision is one
+lookup per particule whatever the number of shapes. Without a container
+the TANK is used.
+
+    python obstacles.py --counts 0 10 100 1000
+
+times the rasterization and the collision for a growing number of shapes.
+"""
+
+import argparse
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+from numba import njit, prange
+import kernel_cache # NOTE: sets the cache folder, before the first @njit
+
+from constants import *
+
+SHAPES = ("circle", "box", "polygon")
+SDF_CELL = 2 # NOTE: pixels between two samples of the field
+# NOTE: obstacles are only rasterized around their bounding box, up to this distance
+SDF_BAND = 16
+RESTITUTION = 0.7 # NOTE: as tank_collision, the normal velocity is flipped and scaled by it
+
+
+def parse_shapes(text: str) -> list[tuple[str, bool, np.ndarray]]:
+    """`(kind, is_container, values)` for each line of `text`."""
+    shapes = []
+    for number, line in enumerate(text.splitlines(), 1):
+        words = line.split("#")[0].split()
+        if not words:
+            continue
+
+        container = words[0] == "container"
+        if container:
+            words = words[1:]
+        kind, values = (words[0], words[1:]) if words else ("", [])
+
+        sizes = {"circle": (3,), "box": (4,)}.get(kind)
+        valid = kind in SHAPES and (
+            len(values) in sizes if sizes else len(values) >= 6 and len(values) % 2 == 0
+        )
+        if not valid:
+            raise ValueError(f"line {number}: expected [container] {'|'.join(SHAPES)} and its values, got {line!r}")
+        shapes.append((kind, container, np.array(values, dtype=np.float64)))
+
+    return shapes
+
+
+def shape_distance(kind: str, values: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """Signed distance of `points` (M, 2) to a shape, negative inside."""
+    if kind == "circle":
+        return np.hypot(*(points - values[:2]).T) - values[2]
+
+    if kind == "box":
+        half = values[2:] / 2
+        q = np.abs(points - (values[:2] + half)) - half
+        return np.hypot(*np.maximum(q, 0).T) + np.minimum(q.max(axis=1), 0)
+
+    vertices = values.reshape((-1, 2))
+    distance = np.full(points.shape[0], np.inf)
+    inside = np.zeros(points.shape[0], dtype=np.bool_)
+    for a, b in zip(vertices, np.roll(vertices, -1, axis=0)):
+        edge, rel = b - a, points - a
+        t = np.clip(rel @ edge / (edge @ edge), 0, 1)
+        distance = np.minimum(distance, np.hypot(*(rel - np.outer(t, edge)).T))
+
+        # NOTE: even-odd rule, edges crossing the horizontal through the point
+        crosses = (a[1] > points[:, 1]) != (b[1] > points[:, 1])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x = a[0] + (points[:, 1] - a[1]) * edge[0] / edge[1]
+        inside ^= crosses & (points[:, 0] < x)
+
+    return np.where(inside, -distance, distance)
+
+
+@njit(cache=True)
+def solid_depth(solid: np.ndarray, cell: float) -> np.ndarray:
+    """Distance of each sample to the nearest free one (chamfer, 8
+    neighbors), 0 for the free ones.
+    """
+    nx, ny = solid.shape
+    diagonal = cell * np.sqrt(2)
+    depth = np.where(solid, np.inf, 0.0)
+    for ix in range(nx):
+        for iy in range(ny):
+            if ix > 0:
+                depth[ix, iy] = min(depth[ix, iy], depth[ix -1, iy] + cell)
+                if iy > 0: depth[ix, iy] = min(depth[ix, iy], depth[ix -1, iy -1] + diagonal)
+                if iy < ny -1: depth[ix, iy] = min(depth[ix, iy], depth[ix -1, iy +1] + diagonal)
+            if iy > 0:
+                depth[ix, iy] = min(depth[ix, iy], depth[ix, iy -1] + cell)
+
+    for ix in range(nx -1, -1, -1):
+        for iy in range(ny -1, -1, -1):
+            if ix < nx -1:
+                depth[ix, iy] = min(depth[ix, iy], depth[ix +1, iy] + cell)
+                if iy > 0: depth[ix, iy] = min(depth[ix, iy], depth[ix +1, iy -1] + diagonal)
+                if iy < ny -1: depth[ix, iy] = min(depth[ix, iy], depth[ix +1, iy +1] + diagonal)
+            if iy < ny -1:
+                depth[ix, iy] = min(depth[ix, iy], depth[ix, iy +1] + cell)
+
+    return depth
+
+
+class ObstacleField:
+    """Distances (and gradients) to the nearest solid, sampled every `cell`
+    pixels over the window: `distance[ix, iy]` at `(ix * cell, iy * cell)`.
+    """
+
+    def __init__(self, shapes: list[tuple[str, bool, np.ndarray]], cell: float = SDF_CELL):
+        self.shapes = shapes
+        self.cell = cell
+        if not any(container for _, container, _ in shapes):
+            self.shapes = [("box", True, np.array(TANK, dtype=np.float64))] + shapes
+
+        nx, ny = int(WIN_RES.x // cell) +1, int(WIN_RES.y // cell) +1
+        xs, ys = np.arange(nx) * cell, np.arange(ny) * cell
+        self.distance = np.full((nx, ny), np.inf)
+        for kind, container, values in self.shapes:
+            if container:
+                points = np.stack(np.meshgrid(xs, ys, indexing="ij"), axis=-1).reshape((-1, 2))
+                self.distance = np.minimum(self.distance, -shape_distance(kind, values, points).reshape((nx, ny)))
+                continue
+
+            # NOTE: the obstacle is farther than SDF_BAND everywhere else
+            x0, y0, x1, y1 = self._bounds(kind, values)
+            i0, i1 = np.searchsorted(xs, [x0 - SDF_BAND, x1 + SDF_BAND])
+            j0, j1 = np.searchsorted(ys, [y0 - SDF_BAND, y1 + SDF_BAND])
+            if i0 >= i1 or j0 >= j1:
+                continue
+            points = np.stack(np.meshgrid(xs[i0:i1], ys[j0:j1], indexing="ij"), axis=-1).reshape((-1, 2))
+            window = self.distance[i0:i1, j0:j1]
+            window[:] = np.minimum(window, shape_distance(kind, values, points).reshape(window.shape))
+
+        # NOTE: the min of the shapes is only exact out of the solids, inside
+        # of touching shapes it measures to the shared edge, not to the liquid
+        solid = self.distance <= 0
+        depth = solid_depth(solid, cell)
+        self.distance[solid] = -np.maximum(-self.distance[solid], depth[solid] - cell)
+
+        gx, gy = np.gradient(self.distance, cell)
+        norm = np.hypot(gx, gy)
+        norm[norm == 0] = 1
+        # NOTE: float32, half the memory the lookups go through
+        self.gradient = np.stack((gx / norm, gy / norm), axis=-1).astype(np.float32)
+        self.distance = self.distance.astype(np.float32)
+
+    @staticmethod
+    def _bounds(kind: str, values: np.ndarray) -> tuple[float, float, float, float]:
+        if kind == "circle":
+            x, y, r = values
+            return x - r, y - r, x + r, y + r
+        if kind == "box":
+            x, y, w, h = values
+            return x, y, x + w, y + h
+
+        vertices = values.reshape((-1, 2))
+        return (*vertices.min(axis=0), *vertices.max(axis=0))
+
+    @classmethod
+    def load(cls, path: str | Path, cell: float = SDF_CELL) -> "ObstacleField":
+        return cls(parse_shapes(Path(path).read_text()), cell)
+
+    def solid_mask(self) -> np.ndarray:
+        return self.distance < 0
+
+    def outline(self) -> np.ndarray:
+        """Solid samples next to a free one, what the viewer draws."""
+        solid = self.solid_mask()
+        free = np.pad(~solid, 1, constant_values=False)
+        touching = free[:-2, 1:-1] | free[2:, 1:-1] | free[1:-1, :-2] | free[1:-1, 2:]
+        return solid & touching
+
+
+@njit(cache=True)
+def sample(grid: np.ndarray, ix: int, iy: int, tx: float, ty: float) -> float:
+    """Bilinear interpolation between `grid[ix:ix+2, iy:iy+2]`."""
+    return (
+        (grid[ix, iy] * (1 -tx) + grid[ix +1, iy] * tx) * (1 -ty)
+        + (grid[ix, iy +1] * (1 -tx) + grid[ix +1, iy +1] * tx) * ty
+    )
+
+@njit(parallel=True, nogil=True, cache=True)
+def sdf_collision(
+    positions: np.ndarray, velocities: np.ndarray,
+    distance: np.ndarray, gradient: np.ndarray, cell: float, radius: float
+) -> None:
+    """In place: particules closer than `radius` to a solid are put back at
+    `radius` (+0.1) of it, and their velocity into it is reflected.
+    """
+    nx, ny = distance.shape
+    normal_x, normal_y = gradient[:, :, 0], gradient[:, :, 1]
+    for i in prange(positions.shape[0]):
+        x, y = positions[i, 0], positions[i, 1]
+        if not (x == x and y == y):
+            continue
+
+        # NOTE: out of the field, the border value minus the way to it
+        fx = min(max(x / cell, 0.0), nx -1.001)
+        fy = min(max(y / cell, 0.0), ny -1.001)
+        outside = np.hypot(x - fx * cell, y - fy * cell)
+
+        ix, iy = int(fx), int(fy)
+        tx, ty = fx - ix, fy - iy
+        dst = sample(distance, ix, iy, tx, ty) - outside
+        if dst >= radius:
+            continue
+
+        gx = sample(normal_x, ix, iy, tx, ty)
+        gy = sample(normal_y, ix, iy, tx, ty)
+        norm = np.hypot(gx, gy)
+        if norm == 0:
+            continue
+        gx, gy = gx / norm, gy / norm
+
+        push = radius + 0.1 - dst
+        positions[i, 0] += gx * push
+        positions[i, 1] += gy * push
+
+        vn = velocities[i, 0] * gx + velocities[i, 1] * gy
+        if vn < 0:
+            velocities[i, 0] -= (1 + RESTITUTION) * vn * gx
+            velocities[i, 1] -= (1 + RESTITUTION) * vn * gy
+
+
+def random_circles(count: int, rng: np.random.Generator) -> list[tuple[str, bool, np.ndarray]]:
+    radii = rng.uniform(3, 12, count)
+    x = rng.uniform(TANK[0], TANK[0] + TANK[2], count)
+    y = rng.uniform(TANK[1], TANK[1] + TANK[3], count)
+    return [("circle", False, np.array(values)) for values in zip(x, y, radii)]
+
+
+if __name__ == "__main__":
+    from liquid import create_particules
+    from utils import tank_collision
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--counts", type=int, nargs="+", default=[0, 10, 100, 1_000])
+    parser.add_argument("--num", type=int, default=20_000, help="particules")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    layout = create_particules(args.num, "random", rng)
+    speeds = rng.normal(0, 50, layout.shape).astype(layout.dtype)
+
+    def time_collision(collide) -> tuple[float, float]:
+        """Mean time once the particules are out of the solids (as in a
+        running simulation), and the fraction still touching one.
+        """
+        positions, velocities = layout.copy(), speeds.copy()
+        collide(positions, velocities)
+        resolved = positions.copy()
+        collide(positions, velocities)
+        contacts = float(np.mean(np.any(positions != resolved, axis=1)))
+
+        start = perf_counter()
+        for _ in range(args.repeat):
+            positions[:] = resolved
+            collide(positions, velocities)
+        return (perf_counter() - start) / args.repeat, contacts
+
+    elapsed, _ = time_collision(tank_collision)
+    print(f"tank_collision: {elapsed*1000:.3f}ms")
+    for count in args.counts:
+        start = perf_counter()
+        field = ObstacleField(random_circles(count, rng))
+        build = perf_counter() - start
+
+        elapsed, contacts = time_collision(
+            lambda pos, vel: sdf_collision(pos, vel, field.distance, field.gradient, field.cell, RADIUS)
+        )
+        print(f"{count} obstacles: rasterized in {build*1000:.0f}ms, collision {elapsed*1000:.3f}ms ({contacts:.1%} in contact)")
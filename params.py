@@ -0,0 +1,53 @@
+"""
+Runtime simulation parameters. They go to the compiled kernels as a
+one-element structured array, so changing a value (live tuning, sweeps)
+needs no recompilation and never leaves a kernel with a stale constant.
+"""
+
+import numpy as np
+from numba import njit
+import kernel_cache # NOTE: sets the cache folder, before the first @njit
+
+from constants import *
+
+PARAMS_DTYPE = np.dtype([
+    ("smoothing_radius", np.float64),
+    ("mass", np.float64),
+    ("factor_density", np.float64),
+    ("factor_slope", np.float64),
+    ("target_density", np.float64),
+    ("factor_pressure", np.float64),
+    ("factor_viscosity", np.float64),
+    ("gravity", np.float64),
+])
+
+DEFAULT_VALUES = {
+    "smoothing_radius": SMOOTHING_RADIUS,
+    "mass": MASS,
+    "factor_density": FACTOR_DENSITY,
+    "factor_slope": FACTOR_SLOPE,
+    "target_density": TARGET_DENSITY,
+    "factor_pressure": FACTOR_PRESSURE,
+    "factor_viscosity": FACTOR_VISCOSITY,
+    "gravity": GRAVITY,
+}
+
+
+def make_params(**values: float) -> np.ndarray:
+    """`make_params(gravity=10)`, unknown names raise a KeyError."""
+    params = np.zeros((1,), dtype=PARAMS_DTYPE)
+    for name, value in {**DEFAULT_VALUES, **values}.items():
+        if name not in DEFAULT_VALUES:
+            raise KeyError(f"unknown parameter {name!r}")
+        params[0][name] = value
+
+    return params
+
+def params_to_dict(params: np.ndarray) -> dict[str, float]:
+    return {name: float(params[0][name]) for name in PARAMS_DTYPE.names}
+
+
+@njit(cache=True)
+def kernel_volume(radius: float) -> float:
+    # NOTE: VOLUME, for any smoothing radius
+    return np.pi * ((radius/PIX_TO_UN) ** 4) / 6
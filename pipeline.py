@@ -0,0 +1,174 @@
+"""
+Pipelined mode: the simulation steps on its own thread while the pygame
+thread renders the last published frame. The compiled kernels release the
+GIL (`nogil=True`), so both threads really run at the same time.
+
+Both threads launch parallel kernels, which needs a threadsafe numba
+threading layer (tbb or omp): set `numba.config.THREADING_LAYER =
+"threadsafe"` before the first parallel kernel runs.
+"""
+
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+from time import perf_counter, sleep
+
+import numpy as np
+
+from filter import get_grid_shape, positions_to_cell, build_cell_index
+from scheduler import FixedStepScheduler
+from simulation import Simulation
+
+# NOTE: what the renderer reads of each published frame
+FRAME_FIELDS = ("positions", "velocities", "densities")
+
+
+class Frame:
+    """A published copy of the simulation state, with the attributes of a
+    Simulation the renderer uses (`pred_pos` and the cell index included,
+    built on demand for the overlays).
+    """
+
+    def __init__(self, sim: Simulation):
+        self.n_parts = sim.n_parts
+        self.params = sim.params
+        self.time = 0.0
+        for name in FRAME_FIELDS:
+            setattr(self, name, np.zeros_like(getattr(sim, name)))
+        self.pred_pos = self.positions
+
+        self.cell_radius = sim.cell_radius
+        self.grid_shape = sim.grid_shape
+        self.cell_keys = np.zeros_like(sim.cell_keys)
+        self.cell_order = np.zeros_like(sim.cell_order)
+        self.cell_start = np.zeros_like(sim.cell_start)
+        self.has_index = False
+
+    def copy_from(self, sim: Simulation):
+        for name in FRAME_FIELDS:
+            np.copyto(getattr(self, name), getattr(sim, name))
+        self.time = sim.time
+        self.has_index = False
+
+        if self.cell_radius != sim.cell_radius:
+            self.cell_radius = sim.cell_radius
+            self.grid_shape = get_grid_shape(self.cell_radius)
+            self.cell_start = np.zeros_like(sim.cell_start)
+
+    def update_index(self):
+        if self.has_index:
+            return
+
+        positions_to_cell(self.positions, self.cell_keys, *self.grid_shape, self.cell_radius)
+        build_cell_index(self.cell_keys, self.cell_order, self.cell_start)
+        self.has_index = True
+
+
+class SimulationThread:
+    """Steps `sim` through `scheduler` in real time on a daemon thread, and
+    publishes a Frame after every batch of substeps.
+
+    Double buffer: the renderer reads the front frame (`read`) while the
+    thread publishes into the back one and swaps them. A publish that would
+    overwrite the frame still being read is skipped, the next one catches up.
+    """
+
+    def __init__(self, sim: Simulation, scheduler: FixedStepScheduler = None, recorder=None):
+        self.sim = sim
+        self.scheduler = scheduler or FixedStepScheduler()
+        self.recorder = recorder
+
+        self.frames = [Frame(sim), Frame(sim)]
+        self.front = 0
+        self.reading = None
+        self.published = 0
+        self.skipped = 0
+        self.frames[0].copy_from(sim)
+
+        # NOTE: `lock` guards the swap and the mouse input, `step_lock` the simulation
+        self.lock = Lock()
+        self.step_lock = Lock()
+        self.mouse = (np.zeros(2), 0, sim.mouse_radius)
+
+        self.running = Event()
+        self.stopped = Event()
+        self.thread = Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.running.set()
+        self.thread.join()
+
+    def set_running(self, running: bool):
+        if running:
+            self.running.set()
+        else:
+            self.running.clear()
+
+    def set_mouse(self, pos: tuple[float, float], value: float, radius: float):
+        with self.lock:
+            self.mouse = (np.asarray(pos, dtype=np.float64), value, radius)
+
+    @contextmanager
+    def paused(self):
+        """Hold the simulation between two steps (reset, checkpoints...),
+        what changed is published on exit.
+        """
+        with self.step_lock:
+            yield self.sim
+            self.publish()
+
+    @contextmanager
+    def read(self):
+        """The front Frame, not overwritten while inside of the block."""
+        with self.lock:
+            k = self.front
+            self.reading = k
+        try:
+            yield self.frames[k]
+        finally:
+            with self.lock:
+                self.reading = None
+
+    def publish(self) -> bool:
+        with self.lock:
+            back = 1 - self.front
+            if self.reading == back:
+                self.skipped += 1
+                return False
+
+        self.frames[back].copy_from(self.sim)
+        with self.lock:
+            self.front = back
+        self.published += 1
+
+        return True
+
+    def _run(self):
+        last = perf_counter()
+        while not self.stopped.is_set():
+            if not self.running.is_set():
+                self.running.wait()
+                last = perf_counter()
+                continue
+
+            now = perf_counter()
+            frame_time, last = now - last, now
+
+            with self.lock:
+                pos, value, radius = self.mouse
+            with self.step_lock:
+                self.sim.mouse_pos[0] = pos
+                self.sim.mouse_value = value
+                self.sim.mouse_radius = radius
+                substeps = self.scheduler.advance(self.sim, frame_time)
+                if substeps:
+                    if self.recorder is not None:
+                        self.recorder.record(self.sim)
+                    self.publish()
+
+            if not substeps:
+                # NOTE: ahead of the wall clock, wait for the next step to be due
+                sleep(max(self.scheduler.dt - self.scheduler.accumulator, 0) / 2)
@@ -0,0 +1,67 @@
+"""
+Lightweight named timers with a rolling window, shared by the headless
+simulation and the pygame viewer.
+"""
+
+from collections import deque
+from contextlib import nullcontext
+from time import perf_counter
+
+_DISABLED = nullcontext()
+
+
+class _Section:
+
+    def __init__(self, history: deque):
+        self.history = history
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.history.append(perf_counter() - self.start)
+        return False
+
+
+class Profiler:
+    """Usage:
+
+        with profiler.section("density"):
+            ...
+
+    `section` returns a shared no-op context while disabled, so leaving
+    the calls in the hot path costs close to nothing. Sections may be
+    timed from several threads (see pipeline.py).
+    """
+
+    def __init__(self, window: int = 60, enabled: bool = False):
+        self.window = window
+        self.enabled = enabled
+        self.sections: dict[str, _Section] = {}
+
+    def section(self, name: str):
+        if not self.enabled:
+            return _DISABLED
+
+        section = self.sections.get(name)
+        if section is None:
+            section = _Section(deque(maxlen=self.window))
+            self.sections[name] = section
+
+        return section
+
+    def clear(self):
+        self.sections.clear()
+
+    def last(self) -> dict[str, float]:
+        """Last timing of each section, in seconds."""
+        return {name: s.history[-1] for name, s in list(self.sections.items()) if s.history}
+
+    def summary(self) -> dict[str, float]:
+        """Mean of each section over the rolling window, in seconds."""
+        return {
+            name: sum(s.history) / len(s.history)
+            for name, s in list(self.sections.items()) if s.history
+        }
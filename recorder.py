@@ -0,0 +1,164 @@
+"""
+Trajectory recording and playback. A recording is a folder with one
+preallocated `.npy` file per field, shaped (frames, particules[, 2]), plus
+`times.npy` and a small `meta.json`:
+
+    with TrajectoryRecorder("runs/dam", sim.n_parts, 1_000, ("positions", "densities")) as rec:
+        for _ in range(1_000):
+            sim.step(dt)
+            rec.record(sim)
+
+    traj = Trajectory("runs/dam")
+    traj.frame(10)["positions"]
+"""
+
+import json
+import queue
+from pathlib import Path
+from threading import Thread
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from simulation import PARTICULE_FIELDS
+
+FIELD_COLUMNS = dict(PARTICULE_FIELDS)
+
+
+class TrajectoryRecorder:
+    """`record` copies the state into one of two snapshot buffers and hands
+    it to a writer thread, so the step loop never waits for the disk. If
+    both buffers are still being written, the frame is dropped (and
+    counted in `dropped`) instead.
+    """
+
+    def __init__(
+        self, path: str | Path, num_particules: int, max_frames: int,
+        fields: tuple[str, ...] = ("positions",), dtype: np.dtype = np.float32
+    ):
+        unknown = set(fields) - set(FIELD_COLUMNS)
+        if unknown or "positions" not in fields:
+            raise ValueError(f"fields must be positions and some of {tuple(FIELD_COLUMNS)}, got {fields}")
+
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        # NOTE: what a previous recording left here would be read with this one
+        (self.path / "meta.json").unlink(missing_ok=True)
+        for name in set(FIELD_COLUMNS) - set(fields):
+            (self.path / f"{name}.npy").unlink(missing_ok=True)
+        self.num_particules = num_particules
+        self.max_frames = max_frames
+        self.fields = tuple(fields)
+
+        self.files = {}
+        for name in self.fields:
+            cols = FIELD_COLUMNS[name]
+            shape = (num_particules, cols) if cols > 1 else (num_particules,)
+            self.files[name] = open_memmap(self.path / f"{name}.npy", "w+", dtype, (max_frames, *shape))
+        self.times = open_memmap(self.path / "times.npy", "w+", np.float64, (max_frames,))
+        self.times[:] = np.nan
+
+        # NOTE: double buffer, indices of the free ones go through `free`
+        self.buffers = [{name: np.zeros(f.shape[1:], dtype) for name, f in self.files.items()} for _ in range(2)]
+        self.free = queue.Queue()
+        self.free.put(0)
+        self.free.put(1)
+        self.pending = queue.Queue()
+
+        self.frames = 0
+        self.dropped = 0
+        self.writer = Thread(target=self._write, daemon=True)
+        self.writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    @property
+    def is_full(self) -> bool:
+        return self.frames >= self.max_frames
+
+    def record(self, sim) -> bool:
+        """Queue the current state of `sim`, False if the frame was dropped."""
+        if self.is_full:
+            return False
+
+        try:
+            k = self.free.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            return False
+
+        for name, buffer in self.buffers[k].items():
+            sim.by_id(name, buffer)
+        self.pending.put((k, self.frames, sim.time))
+        self.frames += 1
+
+        return True
+
+    def _write(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+
+            k, frame, time = item
+            for name, buffer in self.buffers[k].items():
+                self.files[name][frame] = buffer
+            self.times[frame] = time
+            self.free.put(k)
+
+    def close(self):
+        if not self.writer.is_alive():
+            return
+
+        self.pending.put(None)
+        self.writer.join()
+        for f in (*self.files.values(), self.times):
+            f.flush()
+
+        meta = {
+            "num_particules": self.num_particules,
+            "frames": self.frames,
+            "fields": self.fields,
+            "dropped": self.dropped,
+        }
+        with open(self.path / "meta.json", "w") as f:
+            json.dump(meta, f, indent=2)
+
+
+class Trajectory:
+    """Read-only, memory-mapped view of a recording."""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.times = np.load(self.path / "times.npy", mmap_mode="r")
+
+        meta_path = self.path / "meta.json"
+        if meta_path.exists():
+            with open(meta_path) as f:
+                meta = json.load(f)
+            self.frames = meta["frames"]
+            self.fields = tuple(meta["fields"])
+        else:
+            # NOTE: the recorder was not closed, keep the frames written so far
+            missing = np.isnan(self.times)
+            self.frames = int(np.argmax(missing)) if missing.any() else self.times.shape[0]
+            self.fields = tuple(name for name in FIELD_COLUMNS if (self.path / f"{name}.npy").exists())
+
+        self.data = {name: np.load(self.path / f"{name}.npy", mmap_mode="r") for name in self.fields}
+        self.num_particules = self.data["positions"].shape[1]
+
+    def __len__(self) -> int:
+        return self.frames
+
+    def frame(self, i: int) -> dict[str, np.ndarray]:
+        return {name: data[i] for name, data in self.data.items()}
+
+    def frame_at(self, time: float) -> int:
+        """Last frame recorded at or before `time`."""
+        i = np.searchsorted(self.times[:self.frames], time, side="right") -1
+        return min(max(int(i), 0), self.frames -1)
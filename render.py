@@ -0,0 +1,149 @@
+"""
+Compiled rendering helpers: write straight into the pixel array of a
+surface (`pg.surfarray.pixels3d`, indexed as [x, y, rgb]) instead of one
+`pg.draw` call per particule.
+"""
+
+import numpy as np
+from numba import njit, prange
+import kernel_cache # NOTE: sets the cache folder, before the first @njit
+
+from constants import *
+
+WATER = np.array(COLOR_WATER[:3], dtype=np.float64)
+MORE_ATRIB = np.array(COLOR_MORE_ATRIB[:3], dtype=np.float64)
+LESS_ATRIB = np.array(COLOR_LESS_ATRIB[:3], dtype=np.float64)
+WHITE = np.array((250, 250, 250), dtype=np.float64)
+BLACK = np.zeros(3, dtype=np.float64)
+
+MAX_SPEED_COLOR = 150 # NOTE: speed (pixels/s) with the "hottest" color
+
+# NOTE: pixel offsets of a filled particule circle
+DISC = np.array([
+    (dx, dy)
+    for dy in range(-RADIUS, RADIUS +1)
+    for dx in range(-RADIUS, RADIUS +1)
+    if dx*dx + dy*dy <= RADIUS*RADIUS
+])
+
+
+@njit(cache=True)
+def lerp(a: np.ndarray, b: np.ndarray, t: float, out: np.ndarray) -> None:
+    t = min(max(t, 0.0), 1.0)
+    for c in range(3):
+        out[c] = a[c] + (b[c] - a[c]) * t
+
+@njit(cache=True)
+def density_color(density: float, target: float, out: np.ndarray) -> None:
+    # NOTE: same mapping as utils.get_density_color
+    value = density - target
+    ref = 0.01
+
+    if abs(value) < ref:
+        out[:] = 0
+
+    elif value >= ref:
+        aux = np.log(value -ref +1) / np.log(MAX_DENSITY -ref +1)
+        lerp(BLACK, MORE_ATRIB, aux, out)
+
+    else:
+        aux = np.log(max(density, 0) +1) / np.log(target -ref +1)
+        lerp(LESS_ATRIB, BLACK, aux, out)
+
+@njit(parallel=True, nogil=True, cache=True)
+def density_colors(densities: np.ndarray, params: np.ndarray, out: np.ndarray) -> np.ndarray:
+    target = params[0].target_density
+    for i in prange(densities.shape[0]):
+        density_color(densities[i], target, out[i])
+
+    return out
+
+@njit(parallel=True, nogil=True, cache=True)
+def speed_colors(velocities: np.ndarray, out: np.ndarray) -> np.ndarray:
+    for i in prange(velocities.shape[0]):
+        speed = np.sqrt(velocities[i, 0]**2 + velocities[i, 1]**2)
+        lerp(WATER, WHITE, speed / MAX_SPEED_COLOR, out[i])
+
+    return out
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def rasterize_particules(pixels: np.ndarray, positions: np.ndarray, colors: np.ndarray) -> None:
+    """Draw every particule as a filled circle of RADIUS into `pixels`.
+    `colors` has one row per particule, or a single row for all of them.
+    """
+    width, height = pixels.shape[0], pixels.shape[1]
+    single = colors.shape[0] == 1
+
+    # NOTE: overlapping particules may race on a pixel, any of the colors is fine
+    for i in prange(positions.shape[0]):
+        x, y = positions[i, 0], positions[i, 1]
+        if not (np.isfinite(x) and np.isfinite(y)):
+            continue
+
+        col = colors[0] if single else colors[i]
+        cx, cy = int(round(x)), int(round(y))
+        for k in range(DISC.shape[0]):
+            px = cx + DISC[k, 0]
+            py = cy + DISC[k, 1]
+            if 0 <= px < width and 0 <= py < height:
+                pixels[px, py, 0] = col[0]
+                pixels[px, py, 1] = col[1]
+                pixels[px, py, 2] = col[2]
+
+
+# NOTE: background density field, sampled every FIELD_STEP pixels
+FIELD_STEP = 5
+
+def get_field_points(step: int = FIELD_STEP) -> tuple[np.ndarray, tuple[int, int]]:
+    """Centers of the field blocks over the tank, x-major so that
+    `values.reshape(shape)` is indexed as [x, y] like a surfarray.
+    """
+    xs = np.arange(int(TANK[0]), int(TANK[0] +TANK[2] -4), step) + step//2 +1
+    ys = np.arange(int(TANK[1]), int(TANK[1] +TANK[3] -4), step) + step//2 +1
+    points = np.stack(np.meshgrid(xs, ys, indexing="ij"), axis=-1).reshape((-1, 2))
+
+    return points.astype(np.float64), (xs.shape[0], ys.shape[0])
+
+
+# NOTE: pressure gradient arrows, one every PIX_TO_UN pixels
+ARROW_SCALE = 1 / 7_000
+ARROW_COLOR = np.array((210, 210, 15), dtype=np.uint8)
+
+def get_arrow_points() -> np.ndarray:
+    inc = PIX_TO_UN//2 +1 -5
+    xs = np.arange(int(TANK[0]), int(TANK[0] +TANK[2] -PIX_TO_UN +1), PIX_TO_UN) + inc
+    ys = np.arange(int(TANK[1]), int(TANK[1] +TANK[3]), PIX_TO_UN) + inc
+    points = np.stack(np.meshgrid(xs, ys, indexing="ij"), axis=-1).reshape((-1, 2))
+
+    return points.astype(np.float64)
+
+@njit(cache=True)
+def stamp(pixels: np.ndarray, x: float, y: float, radius: int, color: np.ndarray) -> None:
+    width, height = pixels.shape[0], pixels.shape[1]
+    cx, cy = int(round(x)), int(round(y))
+    for dy in range(-radius, radius +1):
+        for dx in range(-radius, radius +1):
+            px, py = cx + dx, cy + dy
+            if dx*dx + dy*dy <= radius*radius and 0 <= px < width and 0 <= py < height:
+                pixels[px, py, 0] = color[0]
+                pixels[px, py, 1] = color[1]
+                pixels[px, py, 2] = color[2]
+
+@njit(parallel=True, nogil=True, cache=True)
+def rasterize_arrows(pixels: np.ndarray, starts: np.ndarray, ends: np.ndarray, color: np.ndarray) -> None:
+    """Draw all the arrows (a dot at the start and a 3px line to the end)."""
+    max_len = pixels.shape[0] + pixels.shape[1]
+
+    for i in prange(starts.shape[0]):
+        x0, y0 = starts[i, 0], starts[i, 1]
+        x1, y1 = ends[i, 0], ends[i, 1]
+        stamp(pixels, x0, y0, 4, color)
+        if not (np.isfinite(x1) and np.isfinite(y1)):
+            continue
+
+        length = min(np.sqrt((x1 - x0)**2 + (y1 - y0)**2), max_len)
+        n = int(length * 2) +1
+        for k in range(n +1):
+            t = k / n
+            stamp(pixels, x0 + (x1 - x0) * t, y0 + (y1 - y0) * t, 1, color)
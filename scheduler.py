@@ -0,0 +1,84 @@
+"""
+Fixed-timestep scheduling: the physics advances in steps of a fixed size,
+as many per rendered frame as the frame time asks for (up to a cap), so a
+slow frame never turns into a huge, unstable timestep.
+"""
+
+from time import perf_counter
+
+from constants import PHYSICS_DT, MAX_SUBSTEPS, CFL_NUMBER
+from solver import max_speed
+
+
+class FixedStepScheduler:
+    """`adaptive` shrinks the step below `dt` when the fastest particule
+    would move more than `cfl` smoothing radii in one step.
+    """
+
+    def __init__(
+        self, dt: float = PHYSICS_DT, max_substeps: int = MAX_SUBSTEPS,
+        adaptive: bool = False, cfl: float = CFL_NUMBER, min_dt: float = PHYSICS_DT / 16
+    ):
+        self.dt = dt
+        self.max_substeps = max_substeps
+        self.adaptive = adaptive
+        self.cfl = cfl
+        self.min_dt = min_dt
+
+        self.accumulator = 0.0
+        self.last_dt = dt
+        self.last_substeps = 0
+
+        # NOTE: throughput, counted only while stepping
+        self.steps = 0
+        self.step_time = 0.0
+        self.dropped_time = 0.0
+
+    @property
+    def steps_per_second(self) -> float:
+        return self.steps / self.step_time if self.step_time > 0 else 0.0
+
+    def reset(self):
+        self.accumulator = 0.0
+        self.steps = 0
+        self.step_time = 0.0
+        self.dropped_time = 0.0
+
+    def next_dt(self, sim) -> float:
+        if not self.adaptive:
+            return self.dt
+
+        speed = max_speed(sim.velocities)
+        if not speed > 0:
+            return self.dt
+
+        radius = sim.params[0]["smoothing_radius"]
+        return min(max(self.cfl * radius / speed, self.min_dt), self.dt)
+
+    def advance(self, sim, frame_time: float) -> int:
+        """Run the substeps owed for `frame_time` seconds of wall time."""
+        self.accumulator += frame_time
+        substeps = 0
+
+        start = perf_counter()
+        while substeps < self.max_substeps:
+            dt = self.next_dt(sim)
+            if self.accumulator < dt:
+                break
+
+            sim.step(dt)
+            self.accumulator -= dt
+            self.last_dt = dt
+            substeps += 1
+
+        # NOTE: when capped, drop the backlog instead of spiraling into more substeps
+        if substeps == self.max_substeps and self.accumulator > self.dt:
+            self.dropped_time += self.accumulator - self.dt
+            self.accumulator = self.dt
+
+        if substeps:
+            self.step_time += perf_counter() - start
+            self.steps += substeps
+
+        self.last_substeps = substeps
+        return substeps
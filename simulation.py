@@ -0,0 +1,443 @@
+"""
+Headless simulation: particules state and step logic, no display needed.
+"""
+
+from time import perf_counter
+
+import numba
+import numpy as np
+
+from constants import *
+from liquid import create_particules
+from filter import get_grid_shape, positions_to_cell, build_cell_index, take_rows, scatter_rows
+from solver import (
+    predict_positions, compute_densities, compute_forces, compute_densities_csr, compute_forces_csr,
+    compute_forces_pairs, compute_forces_pairs_csr, compute_forces_table,
+    compute_density_factors, predict_density_errors, correct_velocities, compute_viscosities, limit_speed,
+    update_velocities, apply_mouse_force, integrate, max_speed
+)
+from tables import make_gradient_table
+from utils import tank_collision
+from profiler import Profiler
+from params import make_params
+from neighbors import NeighborList
+from sleep import ActivityTracker
+from obstacles import ObstacleField, sdf_collision
+
+
+NEIGHBOR_MODES = ("grid", "verlet")
+FORCE_MODES = ("gather", "pairs")
+PRESSURE_MODES = ("explicit", "implicit")
+
+# NOTE: per particule state (name, columns), all of it with the same dtype
+PARTICULE_FIELDS = (
+    ("positions", 2), ("pred_pos", 2), ("velocities", 2), ("densities", 1),
+    ("pressures", 2), ("viscosities", 2),
+)
+
+
+class Simulation:
+    """`neighbor_mode`:
+        - `grid` rebuilds the cell index every step
+        - `verlet` keeps neighbor lists within SMOOTHING_RADIUS + `skin`,
+        rebuilt only when some particule moved more than skin/2
+
+    `force_mode`:
+        - `gather` sums the forces of each particule over all of its neighbors
+        - `pairs` visits each pair once and applies it to both particules,
+        each chunk of cells into its own slab of `pair_buffers`, summed at
+        the end: the zeroing and the sum cost chunks x N per step
+
+    Every buffer is allocated once, in `dtype`; the step only writes into them.
+
+    `pressure_mode`:
+        - `explicit` pushes with a pressure from the density error
+        - `implicit` iterates velocity corrections (DFSPH) until the mean
+        compression is below `tolerance` of the target density, which
+        stays stable at larger steps (grid neighbors, gather forces only)
+
+    With `kernel_table` > 0 (grid neighbors, gather forces only), the force
+    pass reads the pressure gradient from a table of that resolution (see
+    tables.py) instead of taking a sqrt per pair.
+
+    With `sleep_steps` > 0 (grid neighbors, gather forces, explicit pressure
+    only), cells whose particules stayed calm for that many steps are put to
+    sleep and skipped by the passes (see sleep.py).
+
+    With `obstacles` (see obstacles.py), the particules collide with its
+    shapes instead of the walls of the TANK.
+
+    With `reorder_every` > 0, every that many steps the particules are
+    sorted by cell, so neighbors sit close in memory. `ids` keeps the
+    particule at each slot: use `by_id` to read a field in a stable order.
+
+    The physical parameters live in `params` (see params.make_params) and
+    may be changed between steps, e.g. `sim.params["gravity"] = 10`.
+    """
+
+    def __init__(
+        self, num_particules: int = NUM_PARTICULES, mode: str = "grid",
+        neighbor_mode: str = "grid", skin: float = SMOOTHING_RADIUS / 2,
+        dtype: np.dtype = np.float32, params: np.ndarray = None, seed: int = None,
+        force_mode: str = "gather", reorder_every: int = 0,
+        kernel_table: int = 0, pressure_mode: str = "explicit",
+        tolerance: float = PRESSURE_TOLERANCE, max_iterations: int = PRESSURE_MAX_ITERATIONS,
+        sleep_steps: int = 0, obstacles: ObstacleField = None
+    ):
+        if neighbor_mode not in NEIGHBOR_MODES:
+            raise ValueError(f"neighbor_mode must be one of {NEIGHBOR_MODES}, got {neighbor_mode!r}")
+        if force_mode not in FORCE_MODES:
+            raise ValueError(f"force_mode must be one of {FORCE_MODES}, got {force_mode!r}")
+        if pressure_mode not in PRESSURE_MODES:
+            raise ValueError(f"pressure_mode must be one of {PRESSURE_MODES}, got {pressure_mode!r}")
+        if kernel_table and (neighbor_mode, force_mode, pressure_mode) != ("grid", "gather", "explicit"):
+            raise ValueError("kernel_table needs neighbor_mode='grid', force_mode='gather' and pressure_mode='explicit'")
+        if pressure_mode == "implicit" and (neighbor_mode, force_mode) != ("grid", "gather"):
+            raise ValueError("pressure_mode='implicit' needs neighbor_mode='grid' and force_mode='gather'")
+        if sleep_steps and (neighbor_mode, force_mode, pressure_mode, kernel_table) != ("grid", "gather", "explicit", 0):
+            raise ValueError("sleep_steps needs the grid, gather and explicit passes, without kernel_table")
+
+        self.n_parts = num_particules
+        self.mode = mode
+        self.neighbor_mode = neighbor_mode
+        self.force_mode = force_mode
+        self.pressure_mode = pressure_mode
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        self.skin = skin
+        self.dtype = np.dtype(dtype)
+        self.time = 0.0
+        self.steps = 0
+        self.reorder_every = reorder_every
+        self.obstacles = obstacles
+        self.profiler = Profiler()
+
+        self.params = make_params() if params is None else params
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+
+        # NOTE: mouse interaction, set by the viewer
+        self.mouse_pos = np.zeros((1, 2))
+        self.mouse_value = 0
+        self.mouse_radius = 50
+        self.mouse_count = 0
+
+        # NOTE: positions, pred_pos, velocities, densities, pressures, viscosities
+        for name, cols in PARTICULE_FIELDS:
+            shape = (num_particules, cols) if cols > 1 else (num_particules,)
+            setattr(self, name, np.zeros(shape, dtype=self.dtype))
+
+        # NOTE: sorted cell index, rebuilt once per step (or per neighbor list build)
+        self.cell_radius = 0.0
+        self.grid_shape = (0, 0)
+        self.cell_keys = np.zeros((num_particules,), dtype=np.int64)
+        self.cell_order = np.zeros((num_particules,), dtype=np.int64)
+        self.cell_start = np.zeros((1,), dtype=np.int64)
+        self.neighbors: NeighborList = None
+        if neighbor_mode == "verlet":
+            self.neighbors = NeighborList(num_particules, skin, self.dtype)
+        self.tracker: ActivityTracker = None
+        if sleep_steps:
+            self.tracker = ActivityTracker(num_particules, sleep_steps)
+
+        # NOTE: particule id at each slot (`slots`: 0..N-1), and the scratch buffers of the reordering
+        self.slots = np.arange(num_particules, dtype=np.int64)
+        self.ids = self.slots.copy()
+        width = max(cols for _, cols in PARTICULE_FIELDS)
+        self.reorder_buffer = np.zeros((num_particules, width), dtype=self.dtype)
+        self.ids_buffer = np.zeros((num_particules, 1), dtype=np.int64)
+
+        # NOTE: implicit pressure state, and the outcome of the last solve
+        self.density_factors: np.ndarray = None
+        self.kappas: np.ndarray = None
+        self.solver_iterations = 0
+        self.solver_error = 0.0
+        if pressure_mode == "implicit":
+            self.density_factors = np.zeros((num_particules,))
+            self.kappas = np.zeros((num_particules,))
+
+        self.gradient_table: np.ndarray = None
+        if kernel_table:
+            self.gradient_table = make_gradient_table(kernel_table)
+
+        # NOTE: one accumulation slab per thread for the pair forces, up to PAIR_CHUNKS
+        self.pair_buffers: np.ndarray = None
+        if force_mode == "pairs":
+            chunks = min(numba.get_num_threads(), PAIR_CHUNKS)
+            self.pair_buffers = np.zeros((chunks, num_particules, 4), dtype=self.dtype)
+
+        self.update_grid()
+        self.reset()
+
+    def reset(self):
+        self.time = 0.0
+        self.steps = 0
+        for name, _ in PARTICULE_FIELDS:
+            getattr(self, name)[:] = 0
+        self.ids[:] = self.slots
+        if self.tracker is not None:
+            self.tracker.reset()
+        self.positions[:] = create_particules(self.n_parts, self.mode, self.rng)
+        if self.obstacles is not None:
+            # NOTE: out of the solids the layout spawned into
+            self.update_collisions()
+        if self.neighbors is not None:
+            self.neighbors.invalidate()
+
+        self.update_predictions(0)
+        self.update_index()
+        self.update_densities()
+        self.update_forces()
+
+    def step(self, dt: float):
+        self.time += dt
+
+        profile = self.profiler.section
+
+        with profile("predict"): self.update_predictions(dt)
+        with profile("index"): self.update_index()
+        if self.tracker is not None:
+            with profile("sleep"): self.update_activity()
+        with profile("density"): self.update_densities()
+        with profile("forces"): self.update_forces()
+        with profile("mouse"): self.update_mouse_force(dt)
+        with profile("velocity"): self.update_velocities(dt)
+        if self.pressure_mode == "implicit":
+            with profile("pressure"): self.update_pressure(dt)
+        with profile("integrate"): self.update_positions(dt)
+        with profile("collision"): self.update_collisions()
+
+        self.steps += 1
+        if self.reorder_every and self.steps % self.reorder_every == 0:
+            with profile("reorder"): self.reorder()
+
+    def update_predictions(self, dt: float):
+        # NOTE: the implicit pressure predicts through the velocities instead
+        if self.pressure_mode == "implicit":
+            dt = 0.0
+        predict_positions(self.positions, self.velocities, dt, self.pred_pos)
+
+    def update_grid(self):
+        """Resize the cell grid when the smoothing radius changed."""
+        radius = float(self.params[0]["smoothing_radius"])
+        if self.neighbor_mode == "verlet":
+            radius += self.skin
+        if radius == self.cell_radius:
+            return
+
+        self.cell_radius = radius
+        self.grid_shape = get_grid_shape(radius)
+        self.cell_start = np.zeros((self.grid_shape[0] * self.grid_shape[1] +1,), dtype=np.int64)
+        if self.neighbors is not None:
+            self.neighbors.radius = radius
+            self.neighbors.invalidate()
+        if self.tracker is not None:
+            self.tracker.resize(self.cell_start.shape[0] -1)
+
+    def update_index(self):
+        self.update_grid()
+        if self.neighbor_mode == "verlet" and not self.neighbors.needs_rebuild(self.pred_pos):
+            return
+
+        positions_to_cell(self.pred_pos, self.cell_keys, *self.grid_shape, self.cell_radius)
+        build_cell_index(self.cell_keys, self.cell_order, self.cell_start)
+
+        if self.neighbor_mode == "verlet":
+            self.neighbors.build(
+                self.pred_pos, self.cell_keys, self.cell_order, self.cell_start, *self.grid_shape
+            )
+
+    @property
+    def active(self) -> np.ndarray:
+        """Mask of the particules the passes update, None when all of them."""
+        return None if self.tracker is None else self.tracker.active
+
+    @property
+    def density_active(self) -> np.ndarray:
+        """Mask of the particules the density pass updates: `active` and
+        the ring of sleeping ones they read.
+        """
+        return None if self.tracker is None else self.tracker.density_active
+
+    def update_activity(self):
+        mouse = None
+        if self.mouse_value != 0:
+            mouse = (self.mouse_pos[0, 0], self.mouse_pos[0, 1], self.mouse_radius)
+
+        self.tracker.update(
+            self.velocities, self.densities, self.cell_keys, self.cell_order, self.cell_start,
+            *self.grid_shape, self.cell_radius, self.params[0]["target_density"], mouse
+        )
+
+    def update_densities(self):
+        if self.pressure_mode == "implicit":
+            compute_density_factors(
+                self.pred_pos, self.cell_keys, self.cell_order, self.cell_start,
+                *self.grid_shape, self.params, self.densities, self.density_factors
+            )
+            return
+
+        if self.neighbor_mode == "verlet":
+            compute_densities_csr(
+                self.pred_pos, self.neighbors.offsets, self.neighbors.indices,
+                self.params, self.densities
+            )
+            return
+
+        compute_densities(
+            self.pred_pos, self.cell_keys, self.cell_order, self.cell_start,
+            *self.grid_shape, self.params, self.densities, self.density_active
+        )
+
+    def update_forces(self):
+        # NOTE: implicit pressure, `pressures` stay at zero
+        if self.pressure_mode == "implicit":
+            compute_viscosities(
+                self.pred_pos, self.velocities, self.cell_keys, self.cell_order, self.cell_start,
+                *self.grid_shape, self.params, self.viscosities
+            )
+            return
+
+        if self.force_mode == "pairs":
+            self.update_pair_forces()
+            return
+
+        if self.neighbor_mode == "verlet":
+            compute_forces_csr(
+                self.pred_pos, self.velocities, self.densities,
+                self.neighbors.offsets, self.neighbors.indices,
+                self.params, self.pressures, self.viscosities
+            )
+            return
+
+        if self.gradient_table is not None:
+            compute_forces_table(
+                self.pred_pos, self.velocities, self.densities,
+                self.cell_keys, self.cell_order, self.cell_start, *self.grid_shape,
+                self.params, self.gradient_table, self.pressures, self.viscosities
+            )
+            return
+
+        compute_forces(
+            self.pred_pos, self.velocities, self.densities,
+            self.cell_keys, self.cell_order, self.cell_start, *self.grid_shape,
+            self.params, self.pressures, self.viscosities, self.active
+        )
+
+    def update_pair_forces(self):
+        if self.neighbor_mode == "verlet":
+            compute_forces_pairs_csr(
+                self.pred_pos, self.velocities, self.densities,
+                self.neighbors.offsets, self.neighbors.indices,
+                self.params, self.pair_buffers, self.pressures, self.viscosities
+            )
+            return
+
+        compute_forces_pairs(
+            self.pred_pos, self.velocities, self.densities,
+            self.cell_order, self.cell_start, *self.grid_shape,
+            self.params, self.pair_buffers, self.pressures, self.viscosities
+        )
+
+    def update_mouse_force(self, dt: float):
+        """Push the particules under the brush, through the cell index."""
+        self.mouse_count = 0
+        if self.mouse_value == 0:
+            return
+
+        # NOTE: the index of a Verlet list is up to skin/2 behind the positions
+        margin = self.skin / 2 if self.neighbor_mode == "verlet" else 0.0
+        self.mouse_count = apply_mouse_force(
+            self.mouse_pos[0, 0], self.mouse_pos[0, 1], self.mouse_radius, self.mouse_value, margin,
+            self.pred_pos, self.velocities, self.densities,
+            self.cell_order, self.cell_start, *self.grid_shape, self.cell_radius, dt
+        )
+
+    def update_velocities(self, dt: float):
+        update_velocities(
+            self.velocities, self.densities, self.pressures, self.viscosities,
+            self.params, dt, self.active
+        )
+
+    def update_pressure(self, dt: float):
+        """Correct the velocities until the mean compression they lead to
+        is within `tolerance` of the target density. A step of dt = 0
+        moves nothing, so there is nothing to correct.
+        """
+        if dt == 0:
+            return
+
+        index = (self.cell_keys, self.cell_order, self.cell_start, *self.grid_shape, self.params, dt)
+        total = self.n_parts * self.params[0]["target_density"]
+
+        self.solver_iterations = 0
+        while True:
+            self.solver_error = predict_density_errors(
+                self.pred_pos, self.velocities, self.densities, self.density_factors, *index, self.kappas
+            ) / total
+            if self.solver_error <= self.tolerance or self.solver_iterations >= self.max_iterations:
+                break
+
+            correct_velocities(self.pred_pos, self.velocities, self.densities, self.kappas, *index)
+            self.solver_iterations += 1
+
+        # NOTE: a compressed start (or a hard impact) is corrected in one step, at
+        # any speed: past the CFL limit the particules would tunnel, so cap it
+        limit_speed(self.velocities, CFL_NUMBER * self.params[0]["smoothing_radius"] / dt)
+
+    def update_positions(self, dt: float):
+        integrate(self.positions, self.velocities, dt)
+
+    def update_collisions(self):
+        if self.obstacles is not None:
+            field = self.obstacles
+            sdf_collision(self.positions, self.velocities, field.distance, field.gradient, field.cell, RADIUS)
+            return
+
+        self.positions, self.velocities = tank_collision(self.positions, self.velocities)
+
+    def reorder(self):
+        """Permute every particule field (and `ids`) into cell order."""
+        # NOTE: from `pred_pos`, as update_index: the overlays look it up with them
+        positions_to_cell(self.pred_pos, self.cell_keys, *self.grid_shape, self.cell_radius)
+        build_cell_index(self.cell_keys, self.cell_order, self.cell_start)
+        order = self.cell_order
+
+        for name, cols in PARTICULE_FIELDS:
+            field = getattr(self, name).reshape((self.n_parts, cols))
+            scratch = self.reorder_buffer[:, :cols]
+            take_rows(field, order, scratch)
+            field[:] = scratch
+
+        for ints in (self.ids, self.cell_keys):
+            take_rows(ints.reshape((-1, 1)), order, self.ids_buffer)
+            ints[:] = self.ids_buffer[:, 0]
+
+        # NOTE: the cell index stays valid (already sorted), the neighbor lists do not
+        order[:] = self.slots
+        if self.neighbors is not None:
+            self.neighbors.invalidate()
+
+    def by_id(self, name: str, out: np.ndarray = None) -> np.ndarray:
+        """Field `name` indexed by particule id, whatever the reordering."""
+        field = getattr(self, name)
+        if out is None:
+            out = np.empty_like(field)
+
+        cols = field.shape[1] if field.ndim > 1 else 1
+        scatter_rows(field.reshape((-1, cols)), self.ids, out.reshape((-1, cols)))
+        return out
+
+
+def warm_up(dtype: np.dtype = np.float32, neighbor_mode: str = "grid", **options) -> float:
+    """Compile (or load from the disk cache) the step kernels with the same
+    signatures a `Simulation(dtype=dtype, **options)` uses, on a tiny one.
+    Returns the time it took, in seconds.
+    """
+    start = perf_counter()
+    sim = Simulation(64, "random", neighbor_mode, dtype=dtype, **options)
+    sim.mouse_value = FACTOR_MOUSE
+    sim.step(PHYSICS_DT)
+    max_speed(sim.velocities)
+
+    return perf_counter() - start
@@ -0,0 +1,131 @@
+"""
+Sleeping cells: once every particule of a cell stayed slow and close to
+the target density for `steps` steps in a row, the cell falls asleep and
+the force pass skips its particules (their velocity is held at zero). A
+cell is awake while it, or one of its 8 neighbors, is not calm, and the
+mouse brush wakes the cells it covers.
+
+The stencil of an awake particule reaches sleeping cells on the border, so
+the density pass covers one more ring of cells than the force pass: every
+density an awake particule reads is fresh, and the force it feels is the
+one of a full pass. The sleeping side gets no reaction, it holds still as
+a wall would, so momentum is not conserved across the border.
+"""
+
+import numpy as np
+from numba import njit, prange
+import kernel_cache # NOTE: sets the cache folder, before the first @njit
+
+from constants import SLEEP_SPEED, SLEEP_DENSITY_ERROR
+from filter import cell_span
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def count_calm_steps(
+    velocities: np.ndarray, densities: np.ndarray, order: np.ndarray, cell_start: np.ndarray,
+    target: float, speed: float, error: float, calm: np.ndarray
+) -> None:
+    """Steps in a row each cell had only slow, close to target particules."""
+    s2 = speed * speed
+    for c in prange(calm.shape[0]):
+        is_calm = True
+        for k in range(cell_start[c], cell_start[c +1]):
+            i = order[k]
+            if velocities[i, 0]**2 + velocities[i, 1]**2 > s2 or abs(densities[i] - target) > error * target:
+                is_calm = False
+                break
+
+        calm[c] = calm[c] +1 if is_calm else 0
+
+@njit(parallel=True, nogil=True, cache=True)
+def wake_cells(calm: np.ndarray, steps: int, nx: int, ny: int, awake: np.ndarray) -> None:
+    for c in prange(calm.shape[0]):
+        cx, cy = c % nx, c // nx
+        is_awake = False
+        for y in range(max(cy -1, 0), min(cy +2, ny)):
+            for x in range(max(cx -1, 0), min(cx +2, nx)):
+                if calm[x + y * nx] < steps:
+                    is_awake = True
+
+        awake[c] = is_awake
+
+@njit(parallel=True, nogil=True, cache=True)
+def grow_cells(cells: np.ndarray, nx: int, ny: int, out: np.ndarray) -> None:
+    """`out`: the cells with one of `cells` among them and their 8 neighbors."""
+    for c in prange(cells.shape[0]):
+        cx, cy = c % nx, c // nx
+        found = False
+        for y in range(max(cy -1, 0), min(cy +2, ny)):
+            for x in range(max(cx -1, 0), min(cx +2, nx)):
+                if cells[x + y * nx]:
+                    found = True
+
+        out[c] = found
+
+@njit(parallel=True, nogil=True, cache=True)
+def mark_active(keys: np.ndarray, awake: np.ndarray, active: np.ndarray) -> int:
+    count = 0
+    for i in prange(keys.shape[0]):
+        active[i] = awake[keys[i]]
+        if active[i]:
+            count += 1
+
+    return count
+
+
+class ActivityTracker:
+
+    def __init__(
+        self, num_particules: int, steps: int,
+        speed: float = SLEEP_SPEED, density_error: float = SLEEP_DENSITY_ERROR
+    ):
+        self.steps = steps
+        self.speed = speed
+        self.density_error = density_error
+
+        self.calm = np.zeros((0,), dtype=np.int64)
+        self.awake = np.ones((0,), dtype=np.bool_)
+        self.active = np.ones((num_particules,), dtype=np.bool_)
+        self.active_count = num_particules
+        # NOTE: the awake cells and the ring around them, for the density pass
+        self.measured = np.ones((0,), dtype=np.bool_)
+        self.density_active = np.ones((num_particules,), dtype=np.bool_)
+
+    @property
+    def active_fraction(self) -> float:
+        return self.active_count / self.active.shape[0]
+
+    def resize(self, n_cells: int):
+        self.calm = np.zeros((n_cells,), dtype=np.int64)
+        self.awake = np.ones((n_cells,), dtype=np.bool_)
+        self.measured = np.ones((n_cells,), dtype=np.bool_)
+        self.reset()
+
+    def reset(self):
+        """Everything awake, counting from zero again."""
+        self.calm[:] = 0
+        self.awake[:] = True
+        self.active[:] = True
+        self.measured[:] = True
+        self.density_active[:] = True
+        self.active_count = self.active.shape[0]
+
+    def update(
+        self, velocities: np.ndarray, densities: np.ndarray, keys: np.ndarray,
+        order: np.ndarray, cell_start: np.ndarray, nx: int, ny: int, cell_radius: float,
+        target: float, mouse: tuple[float, float, float] = None
+    ):
+        """Refresh `active` and `density_active` from the last step's state,
+        the cell index must be the current one. `mouse`: (x, y, radius) of the brush, if any.
+        """
+        count_calm_steps(velocities, densities, order, cell_start, target, self.speed, self.density_error, self.calm)
+        if mouse is not None:
+            x, y, radius = mouse
+            cx0, cx1 = cell_span(x - radius, x + radius, 0, nx, cell_radius)
+            cy0, cy1 = cell_span(y - radius, y + radius, 1, ny, cell_radius)
+            self.calm.reshape((ny, nx))[cy0:cy1 +1, cx0:cx1 +1] = 0
+
+        wake_cells(self.calm, self.steps, nx, ny, self.awake)
+        self.active_count = mark_active(keys, self.awake, self.active)
+        grow_cells(self.awake, nx, ny, self.measured)
+        mark_active(keys, self.measured, self.density_active)
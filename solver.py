@@ -0,0 +1,673 @@
+"""
+Fused SPH passes over the cell index: one pass for the densities and one
+for the pressure and viscosity forces. Same math as the kernels in
+`liquid.py` (kept as reference), evaluated pair by pair.
+
+Physical parameters come from `params` (see params.py), read once per call:
+records can't be captured by the parallel loops, so the fields are unpacked
+into scalars first.
+"""
+
+import numpy as np
+from numba import njit, prange
+import kernel_cache # NOTE: sets the cache folder, before the first @njit
+
+from constants import *
+from filter import get_row_range, cell_span
+from params import kernel_volume
+from tables import gradient_scale, gradient_over_dst
+
+
+@njit(cache=True)
+def kernel(dst: float, radius: float, volume: float) -> float:
+    # NOTE: smoothing_kernel
+    value = max((radius - dst) / PIX_TO_UN, 0)
+    return (value ** 2) / volume
+
+@njit(cache=True)
+def kernel_derivative(dst: float, radius: float, volume: float, factor_slope: float) -> float:
+    # NOTE: smoothing_kernel_derivative
+    value = min(max((dst - radius) / PIX_TO_UN, radius/-PIX_TO_UN), 0)
+    return 2 * value * factor_slope / volume
+
+@njit(cache=True)
+def viscosity_kernel(dst: float, radius: float) -> float:
+    # NOTE: viscosity_smoothing_kernel
+    value = max((radius**2 - dst**2) / PIX_TO_UN**2, 0)
+    return value**3
+
+@njit(cache=True)
+def pressure_of(density: float, target: float, factor: float) -> float:
+    # NOTE: density_to_pressure
+    return abs(density - target) * factor
+
+
+@njit(cache=True)
+def pressure_multiplier(
+    dst: float, density: float, ref_pres: float,
+    radius: float, volume: float, slope: float, target: float, factor: float
+) -> float:
+    # NOTE: one term of calculate_pressure_force, to multiply by the pair direction
+    div = dst * density
+    if div <= 0:
+        div += 0.1
+    shared = (pressure_of(density, target, factor) + ref_pres) / 2
+    return shared * kernel_derivative(dst, radius, volume, slope) / div
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def predict_positions(positions: np.ndarray, velocities: np.ndarray, dt: float, out: np.ndarray) -> None:
+    for i in prange(positions.shape[0]):
+        out[i, 0] = positions[i, 0] + velocities[i, 0] * dt
+        out[i, 1] = positions[i, 1] + velocities[i, 1] * dt
+
+
+@njit(cache=True)
+def density_at(
+    x: float, y: float, key: int, positions: np.ndarray,
+    order: np.ndarray, cell_start: np.ndarray, nx: int, ny: int,
+    radius: float, volume: float, scale: float
+) -> float:
+    influence = 0.0
+    for r in range(3):
+        start, end = get_row_range(key, r, cell_start, nx, ny)
+        for k in range(start, end):
+            j = order[k]
+            dx = positions[j, 0] - x
+            dy = positions[j, 1] - y
+            influence += kernel(np.sqrt(dx*dx + dy*dy), radius, volume)
+
+    return influence * scale
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def compute_densities(
+    positions: np.ndarray, keys: np.ndarray, order: np.ndarray,
+    cell_start: np.ndarray, nx: int, ny: int, params: np.ndarray, densities: np.ndarray,
+    active: np.ndarray = None
+) -> None:
+    """`active`: optional mask, the other particules are skipped (see sleep.py)."""
+    radius = params[0].smoothing_radius
+    volume = kernel_volume(radius)
+    scale = params[0].mass * params[0].factor_density
+    for i in prange(positions.shape[0]):
+        if active is not None and not active[i]:
+            continue
+        densities[i] = density_at(
+            positions[i, 0], positions[i, 1], keys[i],
+            positions, order, cell_start, nx, ny, radius, volume, scale
+        )
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def sample_densities(
+    points: np.ndarray, point_keys: np.ndarray, positions: np.ndarray,
+    order: np.ndarray, cell_start: np.ndarray, nx: int, ny: int,
+    params: np.ndarray, out: np.ndarray
+) -> np.ndarray:
+    """Density at arbitrary points (e.g. a grid for the background),
+    `point_keys` from `positions_to_cell(points, ...)`.
+    """
+    radius = params[0].smoothing_radius
+    volume = kernel_volume(radius)
+    scale = params[0].mass * params[0].factor_density
+    for i in prange(points.shape[0]):
+        out[i] = density_at(
+            points[i, 0], points[i, 1], point_keys[i],
+            positions, order, cell_start, nx, ny, radius, volume, scale
+        )
+
+    return out
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def compute_forces(
+    positions: np.ndarray, velocities: np.ndarray, densities: np.ndarray,
+    keys: np.ndarray, order: np.ndarray, cell_start: np.ndarray, nx: int, ny: int,
+    params: np.ndarray, pressures: np.ndarray, viscosities: np.ndarray,
+    active: np.ndarray = None
+) -> None:
+    radius, slope = params[0].smoothing_radius, params[0].factor_slope
+    target, factor = params[0].target_density, params[0].factor_pressure
+    mass, factor_viscosity = params[0].mass, params[0].factor_viscosity
+    volume = kernel_volume(radius)
+    for i in prange(positions.shape[0]):
+        if active is not None and not active[i]:
+            continue
+        x, y = positions[i, 0], positions[i, 1]
+        vx, vy = velocities[i, 0], velocities[i, 1]
+        ref_pres = pressure_of(densities[i], target, factor)
+        px, py = 0.0, 0.0
+        sx, sy = 0.0, 0.0
+
+        for r in range(3):
+            start, end = get_row_range(keys[i], r, cell_start, nx, ny)
+            for k in range(start, end):
+                j = order[k]
+                dx = positions[j, 0] - x
+                dy = positions[j, 1] - y
+                dst = np.sqrt(dx*dx + dy*dy)
+
+                # pressure (calculate_pressure_force)
+                multiplier = pressure_multiplier(dst, densities[j], ref_pres, radius, volume, slope, target, factor)
+                px += dx * multiplier
+                py += dy * multiplier
+
+                # viscosity (calculate_viscosity_force)
+                visc = viscosity_kernel(dst, radius)
+                sx += (velocities[j, 0] - vx) * visc
+                sy += (velocities[j, 1] - vy) * visc
+
+        pressures[i, 0] = px * mass * 100
+        pressures[i, 1] = py * mass * 100
+        viscosities[i, 0] = sx * mass * factor_viscosity
+        viscosities[i, 1] = sy * mass * factor_viscosity
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def update_velocities(
+    velocities: np.ndarray, densities: np.ndarray,
+    pressures: np.ndarray, viscosities: np.ndarray,
+    params: np.ndarray, dt: float, active: np.ndarray = None
+) -> None:
+    """`active`: optional mask, the other particules are held still."""
+    gravity = params[0].gravity
+    for i in prange(velocities.shape[0]):
+        if active is not None and not active[i]:
+            velocities[i, 0] = 0
+            velocities[i, 1] = 0
+            continue
+        scale = dt / densities[i]
+        velocities[i, 0] += (pressures[i, 0] + viscosities[i, 0]) * scale
+        velocities[i, 1] += (pressures[i, 1] + viscosities[i, 1]) * scale
+        velocities[i, 1] += gravity * dt
+
+
+@njit(nogil=True, cache=True)
+def apply_mouse_force(
+    mouse_x: float, mouse_y: float, rad: float, strength: float, margin: float,
+    positions: np.ndarray, velocities: np.ndarray, densities: np.ndarray,
+    order: np.ndarray, cell_start: np.ndarray, nx: int, ny: int, cell_radius: float, dt: float
+) -> int:
+    """`calculate_mouse_force`, only over the cells the brush covers, added
+    to the velocities in place (as `update_velocities` adds the forces).
+    `margin` grows the brush for an index built on older positions.
+    Returns the number of particules pushed.
+    """
+    reach = rad + margin
+    cx0, cx1 = cell_span(mouse_x - reach, mouse_x + reach, 0, nx, cell_radius)
+    cy0, cy1 = cell_span(mouse_y - reach, mouse_y + reach, 1, ny, cell_radius)
+
+    count = 0
+    for cy in range(cy0, cy1 +1):
+        # NOTE: the cells of a row are contiguous in `order`
+        for k in range(cell_start[cx0 + cy * nx], cell_start[cx1 + cy * nx +1]):
+            i = order[k]
+            dx = mouse_x - positions[i, 0]
+            dy = mouse_y - positions[i, 1]
+            dst = np.sqrt(dx*dx + dy*dy)
+            if dst >= rad:
+                continue
+
+            center_t = 1 - dst/rad
+            if dst > 0.0001:
+                dx, dy = dx/dst, dy/dst
+            else:
+                dx, dy = 0.0, 0.0
+
+            scale = center_t * dt / densities[i]
+            velocities[i, 0] += (dx * strength - velocities[i, 0]) * scale
+            velocities[i, 1] += (dy * strength - velocities[i, 1]) * scale
+            count += 1
+
+    return count
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def max_speed(velocities: np.ndarray) -> float:
+    value = 0.0
+    for i in prange(velocities.shape[0]):
+        value = max(value, velocities[i, 0]**2 + velocities[i, 1]**2)
+
+    return np.sqrt(value)
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def integrate(positions: np.ndarray, velocities: np.ndarray, dt: float) -> None:
+    for i in prange(positions.shape[0]):
+        positions[i, 0] += velocities[i, 0] * dt
+        positions[i, 1] += velocities[i, 1] * dt
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def sample_pressure_forces(
+    points: np.ndarray, point_keys: np.ndarray, positions: np.ndarray, densities: np.ndarray,
+    order: np.ndarray, cell_start: np.ndarray, nx: int, ny: int,
+    params: np.ndarray, out: np.ndarray
+) -> np.ndarray:
+    """Pressure force at arbitrary points, each one using its own sampled
+    density as reference (as the gradient overlay does).
+    """
+    radius, slope = params[0].smoothing_radius, params[0].factor_slope
+    target, factor = params[0].target_density, params[0].factor_pressure
+    mass, scale = params[0].mass, params[0].mass * params[0].factor_density
+    volume = kernel_volume(radius)
+    for i in prange(points.shape[0]):
+        x, y = points[i, 0], points[i, 1]
+        ref_dens = density_at(x, y, point_keys[i], positions, order, cell_start, nx, ny, radius, volume, scale)
+        ref_pres = pressure_of(ref_dens, target, factor)
+        px, py = 0.0, 0.0
+
+        for r in range(3):
+            start, end = get_row_range(point_keys[i], r, cell_start, nx, ny)
+            for k in range(start, end):
+                j = order[k]
+                dx = positions[j, 0] - x
+                dy = positions[j, 1] - y
+                multiplier = pressure_multiplier(
+                    np.sqrt(dx*dx + dy*dy), densities[j], ref_pres, radius, volume, slope, target, factor
+                )
+                px += dx * multiplier
+                py += dy * multiplier
+
+        out[i, 0] = px * mass * 100
+        out[i, 1] = py * mass * 100
+
+    return out
+
+
+# NOTE: same passes over Verlet neighbor lists (neighbors.NeighborList, CSR)
+@njit(parallel=True, nogil=True, cache=True)
+def compute_densities_csr(
+    positions: np.ndarray, offsets: np.ndarray, indices: np.ndarray,
+    params: np.ndarray, densities: np.ndarray
+) -> None:
+    radius = params[0].smoothing_radius
+    volume = kernel_volume(radius)
+    scale = params[0].mass * params[0].factor_density
+    for i in prange(positions.shape[0]):
+        x, y = positions[i, 0], positions[i, 1]
+        influence = 0.0
+        for k in range(offsets[i], offsets[i +1]):
+            j = indices[k]
+            dx = positions[j, 0] - x
+            dy = positions[j, 1] - y
+            influence += kernel(np.sqrt(dx*dx + dy*dy), radius, volume)
+
+        densities[i] = influence * scale
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def compute_forces_csr(
+    positions: np.ndarray, velocities: np.ndarray, densities: np.ndarray,
+    offsets: np.ndarray, indices: np.ndarray,
+    params: np.ndarray, pressures: np.ndarray, viscosities: np.ndarray
+) -> None:
+    radius, slope = params[0].smoothing_radius, params[0].factor_slope
+    target, factor = params[0].target_density, params[0].factor_pressure
+    mass, factor_viscosity = params[0].mass, params[0].factor_viscosity
+    volume = kernel_volume(radius)
+    for i in prange(positions.shape[0]):
+        x, y = positions[i, 0], positions[i, 1]
+        vx, vy = velocities[i, 0], velocities[i, 1]
+        ref_pres = pressure_of(densities[i], target, factor)
+        px, py = 0.0, 0.0
+        sx, sy = 0.0, 0.0
+
+        for k in range(offsets[i], offsets[i +1]):
+            j = indices[k]
+            dx = positions[j, 0] - x
+            dy = positions[j, 1] - y
+            dst = np.sqrt(dx*dx + dy*dy)
+
+            multiplier = pressure_multiplier(dst, densities[j], ref_pres, radius, volume, slope, target, factor)
+            px += dx * multiplier
+            py += dy * multiplier
+
+            visc = viscosity_kernel(dst, radius)
+            sx += (velocities[j, 0] - vx) * visc
+            sy += (velocities[j, 1] - vy) * visc
+
+        pressures[i, 0] = px * mass * 100
+        pressures[i, 1] = py * mass * 100
+        viscosities[i, 0] = sx * mass * factor_viscosity
+        viscosities[i, 1] = sy * mass * factor_viscosity
+
+
+# NOTE: same force pass with the pressure gradient read from a table
+# (tables.py) on the squared distance: no sqrt, pairs beyond the radius skipped
+@njit(parallel=True, nogil=True, cache=True)
+def compute_forces_table(
+    positions: np.ndarray, velocities: np.ndarray, densities: np.ndarray,
+    keys: np.ndarray, order: np.ndarray, cell_start: np.ndarray, nx: int, ny: int,
+    params: np.ndarray, table: np.ndarray, pressures: np.ndarray, viscosities: np.ndarray
+) -> None:
+    radius, slope = params[0].smoothing_radius, params[0].factor_slope
+    target, factor = params[0].target_density, params[0].factor_pressure
+    mass, factor_viscosity = params[0].mass, params[0].factor_viscosity
+    scale = gradient_scale(radius, slope)
+    r2 = radius**2
+    inv_r2 = 1 / r2
+    for i in prange(positions.shape[0]):
+        x, y = positions[i, 0], positions[i, 1]
+        vx, vy = velocities[i, 0], velocities[i, 1]
+        ref_pres = pressure_of(densities[i], target, factor)
+        px, py = 0.0, 0.0
+        sx, sy = 0.0, 0.0
+
+        for r in range(3):
+            start, end = get_row_range(keys[i], r, cell_start, nx, ny)
+            for k in range(start, end):
+                j = order[k]
+                dx = positions[j, 0] - x
+                dy = positions[j, 1] - y
+                d2 = dx*dx + dy*dy
+                if d2 >= r2:
+                    continue
+
+                # NOTE: coincident particules have no pressure direction
+                if d2 > 0:
+                    shared = (pressure_of(densities[j], target, factor) + ref_pres) / 2
+                    multiplier = shared * gradient_over_dst(table, d2 * inv_r2, radius, scale) / densities[j]
+                    px += dx * multiplier
+                    py += dy * multiplier
+
+                visc = ((r2 - d2) / PIX_TO_UN**2) ** 3
+                sx += (velocities[j, 0] - vx) * visc
+                sy += (velocities[j, 1] - vy) * visc
+
+        pressures[i, 0] = px * mass * 100
+        pressures[i, 1] = py * mass * 100
+        viscosities[i, 0] = sx * mass * factor_viscosity
+        viscosities[i, 1] = sy * mass * factor_viscosity
+
+
+# NOTE: implicit pressure (DFSPH constant density solver). Instead of a
+# pressure from the current density error, the velocities are corrected
+# until the density they predict for the end of the step is within a
+# tolerance of the target. As the explicit pressure, only compression is
+# corrected (always repulsive).
+@njit(cache=True)
+def density_gradient(dst: float, radius: float, volume: float) -> float:
+    """-kernel'(dst) / dst: the gradient of `kernel` for the particule i is
+    this times `x_j - x_i`.
+    """
+    return 2 * (radius - dst) / (PIX_TO_UN**2 * volume * dst)
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def compute_density_factors(
+    positions: np.ndarray, keys: np.ndarray, order: np.ndarray,
+    cell_start: np.ndarray, nx: int, ny: int, params: np.ndarray,
+    densities: np.ndarray, factors: np.ndarray
+) -> None:
+    """Densities, and the DFSPH factor of each particule: how much its
+    density responds to a correction of its neighborhood.
+    """
+    radius = params[0].smoothing_radius
+    volume = kernel_volume(radius)
+    scale = params[0].mass * params[0].factor_density
+    r2 = radius**2
+    for i in prange(positions.shape[0]):
+        x, y = positions[i, 0], positions[i, 1]
+        influence = 0.0
+        gx, gy, squares = 0.0, 0.0, 0.0
+
+        for r in range(3):
+            start, end = get_row_range(keys[i], r, cell_start, nx, ny)
+            for k in range(start, end):
+                j = order[k]
+                dx = positions[j, 0] - x
+                dy = positions[j, 1] - y
+                d2 = dx*dx + dy*dy
+                if d2 >= r2:
+                    continue
+
+                dst = np.sqrt(d2)
+                influence += kernel(dst, radius, volume)
+                if dst > 0:
+                    g = scale * density_gradient(dst, radius, volume)
+                    gx += g * dx
+                    gy += g * dy
+                    squares += g * g * d2
+
+        densities[i] = influence * scale
+        denom = gx*gx + gy*gy + squares
+        factors[i] = densities[i] / denom if denom > 1e-9 else 0.0
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def predict_density_errors(
+    positions: np.ndarray, velocities: np.ndarray, densities: np.ndarray, factors: np.ndarray,
+    keys: np.ndarray, order: np.ndarray, cell_start: np.ndarray, nx: int, ny: int,
+    params: np.ndarray, dt: float, kappas: np.ndarray
+) -> float:
+    """Compression each particule would reach after `dt` at the current
+    velocities, turned into its stiffness (`kappas`). Returns the sum of
+    the compressions.
+    """
+    radius, target = params[0].smoothing_radius, params[0].target_density
+    volume = kernel_volume(radius)
+    scale = params[0].mass * params[0].factor_density
+    r2 = radius**2
+    total = 0.0
+    for i in prange(positions.shape[0]):
+        x, y = positions[i, 0], positions[i, 1]
+        vx, vy = velocities[i, 0], velocities[i, 1]
+        divergence = 0.0
+
+        for r in range(3):
+            start, end = get_row_range(keys[i], r, cell_start, nx, ny)
+            for k in range(start, end):
+                j = order[k]
+                dx = positions[j, 0] - x
+                dy = positions[j, 1] - y
+                d2 = dx*dx + dy*dy
+                if d2 >= r2 or d2 == 0:
+                    continue
+
+                g = scale * density_gradient(np.sqrt(d2), radius, volume)
+                divergence += g * ((vx - velocities[j, 0]) * dx + (vy - velocities[j, 1]) * dy)
+
+        error = max(densities[i] + dt * divergence - target, 0.0)
+        # NOTE: under-relaxed Jacobi, a full correction overshoots (twice the error for a lone pair)
+        kappas[i] = 0.5 * error * factors[i] / dt**2
+        total += error
+
+    return total
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def correct_velocities(
+    positions: np.ndarray, velocities: np.ndarray, densities: np.ndarray, kappas: np.ndarray,
+    keys: np.ndarray, order: np.ndarray, cell_start: np.ndarray, nx: int, ny: int,
+    params: np.ndarray, dt: float
+) -> None:
+    """Push the particules apart by their stiffness and their neighbors'."""
+    radius = params[0].smoothing_radius
+    volume = kernel_volume(radius)
+    scale = params[0].mass * params[0].factor_density
+    r2 = radius**2
+    for i in prange(positions.shape[0]):
+        x, y = positions[i, 0], positions[i, 1]
+        own = kappas[i] / densities[i]
+        ax, ay = 0.0, 0.0
+
+        for r in range(3):
+            start, end = get_row_range(keys[i], r, cell_start, nx, ny)
+            for k in range(start, end):
+                j = order[k]
+                dx = positions[j, 0] - x
+                dy = positions[j, 1] - y
+                d2 = dx*dx + dy*dy
+                if d2 >= r2 or d2 == 0:
+                    continue
+
+                g = scale * density_gradient(np.sqrt(d2), radius, volume)
+                stiffness = (own + kappas[j] / densities[j]) * g
+                ax += stiffness * dx
+                ay += stiffness * dy
+
+        velocities[i, 0] -= ax * dt
+        velocities[i, 1] -= ay * dt
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def limit_speed(velocities: np.ndarray, limit: float) -> None:
+    for i in prange(velocities.shape[0]):
+        speed = np.sqrt(velocities[i, 0]**2 + velocities[i, 1]**2)
+        if speed > limit:
+            velocities[i, 0] *= limit / speed
+            velocities[i, 1] *= limit / speed
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def compute_viscosities(
+    positions: np.ndarray, velocities: np.ndarray,
+    keys: np.ndarray, order: np.ndarray, cell_start: np.ndarray, nx: int, ny: int,
+    params: np.ndarray, viscosities: np.ndarray
+) -> None:
+    """The viscosity half of `compute_forces`."""
+    radius = params[0].smoothing_radius
+    scale = params[0].mass * params[0].factor_viscosity
+    for i in prange(positions.shape[0]):
+        x, y = positions[i, 0], positions[i, 1]
+        vx, vy = velocities[i, 0], velocities[i, 1]
+        sx, sy = 0.0, 0.0
+
+        for r in range(3):
+            start, end = get_row_range(keys[i], r, cell_start, nx, ny)
+            for k in range(start, end):
+                j = order[k]
+                dx = positions[j, 0] - x
+                dy = positions[j, 1] - y
+                visc = viscosity_kernel(np.sqrt(dx*dx + dy*dy), radius)
+                sx += (velocities[j, 0] - vx) * visc
+                sy += (velocities[j, 1] - vy) * visc
+
+        viscosities[i, 0] = sx * scale
+        viscosities[i, 1] = sy * scale
+
+
+# NOTE: symmetric passes, each pair (i, j) evaluated once and applied to both.
+# The shared pressure and the viscosity terms are the same for i and j (up
+# to the sign); only the density in the divisor changes (dens_j for i and
+# dens_i for j). Each chunk of work accumulates into its own slab of
+# `buffers` (chunks, particules, 4), summed at the end: no races.
+@njit(cache=True)
+def accumulate_pair(
+    i: int, j: int, positions: np.ndarray, velocities: np.ndarray, densities: np.ndarray,
+    radius: float, volume: float, slope: float, target: float, factor: float, out: np.ndarray
+) -> None:
+    dx = positions[j, 0] - positions[i, 0]
+    dy = positions[j, 1] - positions[i, 1]
+    dst = np.sqrt(dx*dx + dy*dy)
+    if dst >= radius:
+        return
+
+    # NOTE: coincident particules have no pressure direction, as in the gather pass
+    if dst > 0:
+        shared = (pressure_of(densities[i], target, factor) + pressure_of(densities[j], target, factor)) / 2
+        shared *= kernel_derivative(dst, radius, volume, slope) / dst
+        out[i, 0] += dx * shared / densities[j]
+        out[i, 1] += dy * shared / densities[j]
+        out[j, 0] -= dx * shared / densities[i]
+        out[j, 1] -= dy * shared / densities[i]
+
+    visc = viscosity_kernel(dst, radius)
+    vx = (velocities[j, 0] - velocities[i, 0]) * visc
+    vy = (velocities[j, 1] - velocities[i, 1]) * visc
+    out[i, 2] += vx
+    out[i, 3] += vy
+    out[j, 2] -= vx
+    out[j, 3] -= vy
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def reduce_pair_buffers(
+    buffers: np.ndarray, params: np.ndarray, pressures: np.ndarray, viscosities: np.ndarray
+) -> None:
+    mass, factor_viscosity = params[0].mass, params[0].factor_viscosity
+    for i in prange(pressures.shape[0]):
+        px, py, sx, sy = 0.0, 0.0, 0.0, 0.0
+        for t in range(buffers.shape[0]):
+            px += buffers[t, i, 0]
+            py += buffers[t, i, 1]
+            sx += buffers[t, i, 2]
+            sy += buffers[t, i, 3]
+
+        pressures[i, 0] = px * mass * 100
+        pressures[i, 1] = py * mass * 100
+        viscosities[i, 0] = sx * mass * factor_viscosity
+        viscosities[i, 1] = sy * mass * factor_viscosity
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def compute_forces_pairs(
+    positions: np.ndarray, velocities: np.ndarray, densities: np.ndarray,
+    order: np.ndarray, cell_start: np.ndarray, nx: int, ny: int,
+    params: np.ndarray, buffers: np.ndarray, pressures: np.ndarray, viscosities: np.ndarray
+) -> None:
+    """Same result as `compute_forces`, over a half stencil: each cell
+    against itself, its right neighbor and the 3 cells of the row below.
+    """
+    radius, slope = params[0].smoothing_radius, params[0].factor_slope
+    target, factor = params[0].target_density, params[0].factor_pressure
+    volume = kernel_volume(radius)
+
+    n_chunks = buffers.shape[0]
+    n_cells = cell_start.shape[0] -1
+    num = positions.shape[0]
+    for t in prange(n_chunks):
+        out = buffers[t]
+        out[:] = 0
+
+        # NOTE: chunks of cells with about the same number of particules
+        c0 = np.searchsorted(cell_start, t * num // n_chunks)
+        c1 = n_cells if t == n_chunks -1 else np.searchsorted(cell_start, (t +1) * num // n_chunks)
+        for c in range(c0, c1):
+            start, end = cell_start[c], cell_start[c +1]
+            if start == end:
+                continue
+
+            cx = c % nx
+            right = cell_start[c +2] if cx +1 < nx else end
+            below_start, below_end = get_row_range(c, 2, cell_start, nx, ny)
+            for a in range(start, end):
+                i = order[a]
+                # NOTE: own cell (later ones only) and the right neighbor, contiguous
+                for b in range(a +1, right):
+                    accumulate_pair(i, order[b], positions, velocities, densities, radius, volume, slope, target, factor, out)
+                for b in range(below_start, below_end):
+                    accumulate_pair(i, order[b], positions, velocities, densities, radius, volume, slope, target, factor, out)
+
+    reduce_pair_buffers(buffers, params, pressures, viscosities)
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def compute_forces_pairs_csr(
+    positions: np.ndarray, velocities: np.ndarray, densities: np.ndarray,
+    offsets: np.ndarray, indices: np.ndarray,
+    params: np.ndarray, buffers: np.ndarray, pressures: np.ndarray, viscosities: np.ndarray
+) -> None:
+    """Same result as `compute_forces_csr`, only the pairs with j > i."""
+    radius, slope = params[0].smoothing_radius, params[0].factor_slope
+    target, factor = params[0].target_density, params[0].factor_pressure
+    volume = kernel_volume(radius)
+
+    n_chunks = buffers.shape[0]
+    num = positions.shape[0]
+    for t in prange(n_chunks):
+        out = buffers[t]
+        out[:] = 0
+
+        # NOTE: chunks with about the same number of pairs
+        i0 = np.searchsorted(offsets, t * offsets[num] // n_chunks)
+        i1 = num if t == n_chunks -1 else np.searchsorted(offsets, (t +1) * offsets[num] // n_chunks)
+        for i in range(i0, i1):
+            for k in range(offsets[i], offsets[i +1]):
+                j = indices[k]
+                if j > i:
+                    accumulate_pair(i, j, positions, velocities, densities, radius, volume, slope, target, factor, out)
+
+    reduce_pair_buffers(buffers, params, pressures, viscosities)
@@ -0,0 +1,180 @@
+"""
+Parameter sweep: runs the headless simulation for every combination of a
+parameter grid, in a process pool, and saves summary metrics of each run:
+
+    python sweep.py --grid factor_pressure=1,2,4 factor_viscosity=10,20 --steps 300
+
+Parameter names are the fields of params.PARAMS_DTYPE. The cores are split
+between the workers (`--workers`), each one running its kernels on its
+share of the numba threads, so the box is used without oversubscribing.
+
+With `--checkpoint` every run starts from that saved state (e.g. a settled
+tank, see checkpoint.py), with the grid values on top of its parameters.
+"""
+
+import argparse
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing as mp
+from datetime import datetime
+from time import perf_counter
+from warnings import filterwarnings
+
+import numba
+import numpy as np
+
+filterwarnings("ignore")
+
+
+def parse_grid(items: list[str]) -> dict[str, list[float]]:
+    """`["gravity=0,10", "factor_pressure=2"]` -> `{"gravity": [0, 10], ...}`"""
+    from params import PARAMS_DTYPE
+
+    grid = {}
+    for item in items:
+        name, _, values = item.partition("=")
+        if name not in PARAMS_DTYPE.names or not values:
+            raise ValueError(f"expected <param>=<v1>,<v2>,... with a param of {PARAMS_DTYPE.names}, got {item!r}")
+        grid[name] = [float(v) for v in values.split(",")]
+
+    return grid
+
+def expand_grid(grid: dict[str, list[float]]) -> list[dict[str, float]]:
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+
+def run_one(
+    values: dict[str, float], num_particules: int, steps: int, dt: float,
+    mode: str, sample_every: int = 10, checkpoint: str = None
+) -> dict:
+    """Run one simulation and summarize it. The run stops at the first
+    unstable sample: non finite state, or some particule moving more than
+    a smoothing radius in one step (the integration broke down).
+    """
+    from params import make_params
+    from simulation import Simulation
+    from solver import max_speed
+    from checkpoint import load_simulation
+
+    start = perf_counter()
+    if checkpoint:
+        sim = load_simulation(checkpoint)
+        for name, value in values.items():
+            sim.params[name] = value
+    else:
+        sim = Simulation(num_particules, mode, params=make_params(**values))
+    params = sim.params
+    target = params[0]["target_density"]
+    radius = params[0]["smoothing_radius"]
+
+    density_error, kinetic_energy = [], []
+    unstable_at = None
+    for step in range(1, steps +1):
+        sim.step(dt)
+        if step % sample_every and step != steps:
+            continue
+
+        speed = max_speed(sim.velocities)
+        if not (np.all(np.isfinite(sim.positions)) and speed * dt <= radius):
+            unstable_at = step
+            break
+
+        density_error.append(float(np.mean(np.abs(sim.densities - target))) / target)
+        kinetic_energy.append(0.5 * params[0]["mass"] * float(np.sum(sim.velocities.astype(np.float64)**2)))
+
+    # NOTE: means over the second half of the samples, once the tank settled
+    half = len(density_error) // 2
+    return {
+        "params": values,
+        "stable": unstable_at is None,
+        "unstable_at": unstable_at,
+        "steps": steps,
+        "density_error": density_error[-1] if density_error else None,
+        "mean_density_error": float(np.mean(density_error[half:])) if density_error else None,
+        "kinetic_energy": kinetic_energy[-1] if kinetic_energy else None,
+        "mean_kinetic_energy": float(np.mean(kinetic_energy[half:])) if kinetic_energy else None,
+        "wall_s": perf_counter() - start,
+    }
+
+
+def _init_worker(threads: int) -> None:
+    numba.set_num_threads(threads)
+
+    from simulation import warm_up
+    warm_up()
+
+
+def split_cores(workers: int = None, cores: int = None) -> tuple[int, int]:
+    """(workers, numba threads per worker), never more threads than cores."""
+    cores = cores or os.cpu_count() or 1
+    workers = min(workers or cores, cores)
+    threads = min(max(cores // workers, 1), numba.config.NUMBA_NUM_THREADS)
+
+    return workers, threads
+
+
+def run(
+    grid: dict[str, list[float]], num_particules: int, steps: int, dt: float,
+    mode: str, workers: int = None, sample_every: int = 10, checkpoint: str = None
+) -> list[dict]:
+    workers, threads = split_cores(workers)
+    combos = expand_grid(grid)
+    print(f"{len(combos)} runs on {workers} workers x {threads} threads")
+
+    results = []
+    ctx = mp.get_context("spawn")
+    with ProcessPoolExecutor(workers, ctx, initializer=_init_worker, initargs=(threads,)) as pool:
+        futures = [
+            pool.submit(run_one, values, num_particules, steps, dt, mode, sample_every, checkpoint)
+            for values in combos
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+
+            values = " ".join(f"{k}={v:g}" for k, v in result["params"].items())
+            if result["stable"]:
+                print(
+                    f"{values}: density error {result['mean_density_error']:.1%}, "
+                    f"kinetic energy {result['mean_kinetic_energy']:.3g} ({result['wall_s']:.1f}s)"
+                )
+            else:
+                print(f"{values}: unstable at step {result['unstable_at']} ({result['wall_s']:.1f}s)")
+
+    # NOTE: same order as the grid, whatever the order they finished in
+    results.sort(key=lambda r: combos.index(r["params"]))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--grid", nargs="+", required=True, help="<param>=<v1>,<v2>,...")
+    parser.add_argument("--num", type=int, default=2_000, help="particules per run")
+    parser.add_argument("--steps", type=int, default=300)
+    parser.add_argument("--dt", type=float, default=1 / 120)
+    parser.add_argument("--mode", default="random", help="layout passed to create_particules")
+    parser.add_argument("--workers", type=int, default=None, help="default: one per core")
+    parser.add_argument("--sample-every", type=int, default=10, help="steps between metric samples")
+    parser.add_argument("--checkpoint", default=None, help="start every run from this checkpoint (ignores --num)")
+    parser.add_argument("--output", default="sweep.json")
+    args = parser.parse_args()
+
+    grid = parse_grid(args.grid)
+    results = run(grid, args.num, args.steps, args.dt, args.mode, args.workers, args.sample_every, args.checkpoint)
+    report = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "num_particules": args.num,
+        "steps": args.steps,
+        "dt": args.dt,
+        "mode": args.mode,
+        "checkpoint": args.checkpoint,
+        "grid": grid,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Saved results in {args.output}")
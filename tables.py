@@ -0,0 +1,122 @@
+"""
+Lookup table of the pressure kernel gradient on the squared distance, so
+the force loop needs no sqrt. The table is sampled on `q = dst² / radius²`
+in [0, 1], which makes it independent of the smoothing radius (the radius
+only scales the values, see `gradient_scale`):
+
+    smoothing_kernel_derivative(dst) / dst = gradient_scale * (1 - 1 / sqrt(q))
+
+The viscosity kernel, `(radius² - dst²)³ / PIX_TO_UN⁶`, is already a
+polynomial of the squared distance and needs no table. The density kernel
+keeps its sqrt: a lookup measured slower than `(radius - dst)²` there.
+
+    python tables.py --resolutions 256 1024 4096
+
+prints the error of each resolution against the analytic kernel and times
+the force pass with and without the table.
+"""
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+from numba import njit
+import kernel_cache # NOTE: sets the cache folder, before the first @njit
+
+from constants import *
+from params import kernel_volume
+
+TABLE_RESOLUTION = 1024
+# NOTE: below this many table steps the gradient (~ 1/dst) is computed exactly
+EXACT_STEPS = 16
+
+
+def make_gradient_table(resolution: int = TABLE_RESOLUTION) -> np.ndarray:
+    """`1 - 1/sqrt(q)` every 1/resolution of q, one extra sample so q = 1
+    interpolates too.
+    """
+    q = np.arange(resolution +2) / resolution
+    table = np.zeros((resolution +2,))
+    table[1:] = np.minimum(1 - 1 / np.sqrt(q[1:]), 0)
+    table[0] = table[1]
+
+    return table
+
+
+@njit(cache=True)
+def gradient_scale(radius: float, slope: float) -> float:
+    return 2 * slope / PIX_TO_UN / kernel_volume(radius)
+
+@njit(cache=True)
+def gradient_over_dst(table: np.ndarray, q: float, radius: float, scale: float) -> float:
+    """`kernel_derivative(dst) / dst` at `q` in (0, 1], exact close to 0."""
+    x = q * (table.shape[0] -2)
+    if x < EXACT_STEPS:
+        dst = np.sqrt(q) * radius
+        return scale * (dst - radius) / dst
+
+    k = int(x)
+    frac = x - k
+    return scale * (table[k] * (1 - frac) + table[k +1] * frac)
+
+
+def table_error(table: np.ndarray, radius: float = SMOOTHING_RADIUS, samples: int = 100_000) -> dict[str, float]:
+    """Error of the table against `solver.kernel_derivative`, relative to
+    its largest value.
+    """
+    from solver import kernel_derivative
+
+    slope = FACTOR_SLOPE
+    volume = kernel_volume(radius)
+    scale = gradient_scale(radius, slope)
+
+    # NOTE: uniform in q, as the pairs of a uniform tank are
+    q = np.linspace(0, 1, samples)[1:]
+    dst = np.sqrt(q) * radius
+    exact = np.array([kernel_derivative(d, radius, volume, slope) for d in dst])
+    approx = np.array([gradient_over_dst(table, x, radius, scale) for x in q]) * dst
+
+    error = np.abs(approx - exact) / np.abs(exact).max()
+    return {"resolution": table.shape[0] -2, "max": float(error.max()), "mean": float(error.mean())}
+
+
+def bench_force_pass(table: np.ndarray, num_particules: int = 20_000, repeat: int = 20) -> dict[str, float]:
+    """Mean time of the force pass, analytic and with `table`."""
+    from simulation import Simulation
+    from solver import compute_forces, compute_forces_table
+
+    sim = Simulation(num_particules, "jittered")
+    state = (sim.pred_pos, sim.velocities, sim.densities, sim.cell_keys, sim.cell_order, sim.cell_start)
+    passes = {
+        "analytic": lambda: compute_forces(*state, *sim.grid_shape, sim.params, sim.pressures, sim.viscosities),
+        "table": lambda: compute_forces_table(
+            *state, *sim.grid_shape, sim.params, table, sim.pressures, sim.viscosities
+        ),
+    }
+
+    times = {}
+    for name, run in passes.items():
+        run()
+        start = perf_counter()
+        for _ in range(repeat):
+            run()
+        times[name] = (perf_counter() - start) / repeat
+
+    return times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[256, TABLE_RESOLUTION, 4096])
+    parser.add_argument("--num", type=int, default=20_000, help="particules of the force pass benchmark")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    for resolution in args.resolutions:
+        table = make_gradient_table(resolution)
+        error = table_error(table)
+        times = bench_force_pass(table, args.num, args.repeat)
+        print(
+            f"resolution {resolution}: error {error['max']:.2e} max / {error['mean']:.2e} mean, "
+            f"forces {times['analytic']*1000:.2f}ms -> {times['table']*1000:.2f}ms"
+        )
@@ -1,7 +1,22 @@
-from time import time
+import sys
+import numba
+from time import time, sleep
 from constants import *
 from liquid import *
 from filter import *
+from solver import *
+from simulation import Simulation, PARTICULE_FIELDS, NEIGHBOR_MODES, warm_up
+from profiler import Profiler
+from params import make_params, params_to_dict
+from tables import make_gradient_table, table_error
+from obstacles import ObstacleField, parse_shapes, shape_distance, sdf_collision
+from render import *
+from scheduler import FixedStepScheduler
+from recorder import TrajectoryRecorder, Trajectory
+from checkpoint import save_checkpoint, restore_checkpoint, load_simulation
+from pipeline import SimulationThread
+from sweep import parse_grid, expand_grid, split_cores, run_one
+from utils import get_density_color
 
 
 def test_density():
@@ -24,21 +39,6 @@ def test_density():
 
     return None
 
-# NOTE: v1 - forloop: 10k particules ~ 491s
-# NOTE: v2 - numpy: 10k particules ~ 47s
-# NOTE: v3 - numba: 10k particules ~ 4s
-def time_density():
-    num = 10000
-    positions = create_particules(num)
-    positions = np.array(positions)
-
-    start = time()
-    for i in range(num):
-        _ = calculate_density(positions, positions[i])
-
-    print(f'Took {time() - start:.0f} segs to calculate all densities.')
-
-
 def test_pressure():
     num = 360
     positions = create_particules(num, "grid")
@@ -78,8 +78,679 @@ def test_filter():
     assert inds.sum() == hashes[inds].shape[0]
 
 
+def test_cell_index():
+    num = 900
+    positions = create_particules(num, "grid")
+    hashes = positions_to_hash(positions)
+
+    nx, ny = get_grid_shape()
+    keys = positions_to_cell(positions, np.zeros(num, dtype=np.int64), nx, ny)
+    order = np.zeros(num, dtype=np.int64)
+    cell_start = np.zeros(nx * ny +1, dtype=np.int64)
+    build_cell_index(keys, order, cell_start)
+
+    assert cell_start[-1] == num
+    assert np.all(np.diff(keys[order]) >= 0)
+
+    for i in range(0, num, 7):
+        inds = get_neighbor_indices(keys[i], order, cell_start, nx, ny)
+        expected = np.nonzero(get_indices(hashes[i], hashes))[0]
+        assert np.array_equal(np.sort(inds), expected)
+
+
+def test_solver():
+    num = 900
+    positions = create_particules(num, "grid")
+    positions += np.random.uniform(-2, 2, positions.shape)
+    velocities = np.random.uniform(-5, 5, positions.shape)
+
+    nx, ny = get_grid_shape()
+    keys = positions_to_cell(positions, np.zeros(num, dtype=np.int64), nx, ny)
+    order = np.zeros(num, dtype=np.int64)
+    cell_start = np.zeros(nx * ny +1, dtype=np.int64)
+    build_cell_index(keys, order, cell_start)
+
+    densities = np.zeros(num)
+    pressures = np.zeros((num, 2))
+    viscosities = np.zeros((num, 2))
+    params = make_params()
+    compute_densities(positions, keys, order, cell_start, nx, ny, params, densities)
+    compute_forces(
+        positions, velocities, densities, keys, order, cell_start, nx, ny,
+        params, pressures, viscosities
+    )
+
+    for i in range(0, num, 7):
+        inds = get_neighbor_indices(keys[i], order, cell_start, nx, ny)
+        pos, vel = positions[i:i+1], velocities[i:i+1]
+
+        d = calculate_density(positions[inds], pos)
+        p = calculate_pressure_force(positions[inds], densities[inds], pos, densities[i], FACTOR_PRESSURE)
+        v = calculate_viscosity_force(positions[inds], velocities[inds], pos, vel, FACTOR_VISCOSITY)
+        assert np.isclose(densities[i], d)
+        assert np.allclose(pressures[i], p)
+        assert np.allclose(viscosities[i], v)
+
+
+def test_simulation():
+    sim = Simulation(900)
+    sim.params["gravity"] = 10
+    for _ in range(20):
+        sim.step(0.01)
+
+    assert np.isclose(sim.time, 0.2)
+    assert np.all(np.isfinite(sim.positions))
+    assert np.all(sim.positions[:, 0] >= TANK[0]) and np.all(sim.positions[:, 0] <= TANK[0] +TANK[2])
+    assert np.all(sim.positions[:, 1] >= TANK[1]) and np.all(sim.positions[:, 1] <= TANK[1] +TANK[3])
+
+
+def test_profiler():
+    sim = Simulation(300)
+    sim.step(0.01)
+    assert sim.profiler.summary() == {}
+
+    sim.profiler.enabled = True
+    for _ in range(3):
+        sim.step(0.01)
+
+    summary = sim.profiler.summary()
+    assert list(summary) == ["predict", "index", "density", "forces", "mouse", "velocity", "integrate", "collision"]
+    assert all(len(s.history) == 3 for s in sim.profiler.sections.values())
+    assert all(value >= 0 for value in summary.values())
+
+
+def test_render():
+    densities = np.array([0, 100, TARGET_DENSITY, TARGET_DENSITY +50, 5000])
+    colors = density_colors(densities, make_params(), np.zeros((5, 3), dtype=np.uint8))
+    for d, col in zip(densities, colors):
+        expected = get_density_color(d)
+        assert np.all(np.abs(col.astype(int) - expected[:3]) <= 1)
+
+    pixels = np.zeros((int(WIN_RES.x), int(WIN_RES.y), 3), dtype=np.uint8)
+    positions = np.array([[100.2, 200.7], [-50, 10], [np.nan, 3]])
+    rasterize_particules(pixels, positions, np.array([[1, 2, 3]], dtype=np.uint8))
+    assert np.array_equal(pixels[100, 201], [1, 2, 3])
+    assert pixels.any(axis=-1).sum() == DISC.shape[0]
+
+
+def test_density_field():
+    sim = Simulation(900)
+    points, shape = get_field_points()
+    assert points.shape[0] == shape[0] * shape[1]
+
+    keys = positions_to_cell(points, np.zeros(points.shape[0], dtype=np.int64), *sim.grid_shape)
+    values = sample_densities(
+        points, keys, sim.pred_pos, sim.cell_order, sim.cell_start,
+        *sim.grid_shape, sim.params, np.zeros(points.shape[0])
+    )
+    for i in range(0, points.shape[0], 97):
+        expected = calculate_density(sim.pred_pos.astype(np.float64), points[i:i+1])
+        assert np.isclose(values[i], expected)
+
+
+def test_pressure_arrows():
+    sim = Simulation(900)
+    nx, ny = sim.grid_shape
+    points = get_arrow_points()
+    keys = positions_to_cell(points, np.zeros(points.shape[0], dtype=np.int64), nx, ny)
+    forces = sample_pressure_forces(
+        points, keys, sim.pred_pos, sim.densities, sim.cell_order, sim.cell_start,
+        nx, ny, sim.params, np.zeros(points.shape)
+    )
+
+    pred_pos = sim.pred_pos.astype(np.float64)
+    densities = sim.densities.astype(np.float64)
+    for i in range(points.shape[0]):
+        inds = get_neighbor_indices(keys[i], sim.cell_order, sim.cell_start, nx, ny)
+        pos = points[i:i+1]
+        d = calculate_density(pred_pos[inds], pos)
+        p = calculate_pressure_force(pred_pos[inds], densities[inds], pos, d)
+        assert np.allclose(forces[i], p, rtol=1e-4, atol=1e-3)
+
+
+def test_verlet_lists():
+    grid = Simulation(900)
+    verlet = Simulation(900, neighbor_mode="verlet")
+    assert np.allclose(grid.densities, verlet.densities)
+    assert np.allclose(grid.pressures, verlet.pressures, rtol=1e-4, atol=1e-2)
+
+    for _ in range(10):
+        grid.step(0.005)
+        verlet.step(0.005)
+
+    assert np.allclose(grid.positions, verlet.positions, atol=1e-2)
+    assert np.allclose(grid.densities, verlet.densities, rtol=1e-3)
+    assert 1 <= verlet.neighbors.builds < verlet.neighbors.checks
+
+
+def test_scheduler():
+    sim = Simulation(300)
+    scheduler = FixedStepScheduler(dt=0.01, max_substeps=4)
+
+    assert scheduler.advance(sim, 0.025) == 2
+    assert np.isclose(scheduler.accumulator, 0.005)
+    assert np.isclose(sim.time, 0.02)
+
+    # NOTE: a slow frame is capped, not turned into a bigger step
+    assert scheduler.advance(sim, 1.0) == 4
+    assert scheduler.accumulator <= scheduler.dt
+    assert scheduler.last_dt == 0.01
+
+    scheduler.adaptive = True
+    sim.velocities[0] = (1e4, 0)
+    assert np.isclose(scheduler.next_dt(sim), max(CFL_NUMBER * SMOOTHING_RADIUS / 1e4, scheduler.min_dt))
+    sim.velocities[0] = (100, 0)
+    assert np.isclose(scheduler.next_dt(sim), min(CFL_NUMBER * SMOOTHING_RADIUS / 100, scheduler.dt))
+    assert scheduler.steps == 6 and scheduler.steps_per_second > 0
+
+
+def peak_rss_growth(func) -> int:
+    """Growth of the peak RSS (kB) while running `func`, linux only."""
+    def hwm():
+        with open("/proc/self/status") as f:
+            return next(int(l.split()[1]) for l in f if l.startswith("VmHWM"))
+
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    start = hwm()
+    func()
+    return hwm() - start
+
+
+def test_no_allocations():
+    num = 100_000
+    sim = Simulation(num, "random")
+    assert all(getattr(sim, name).dtype == np.float32 for name, _ in PARTICULE_FIELDS)
+    buffers = {name: getattr(sim, name) for name, _ in PARTICULE_FIELDS}
+    sim.step(0.01)
+
+    def steps():
+        for _ in range(3):
+            sim.step(0.01)
+
+    # NOTE: any temporary as big as one float32 column would show up
+    if sys.platform == "linux":
+        assert peak_rss_growth(steps) < num * 4 / 1024
+    assert all(getattr(sim, name) is buffer for name, buffer in buffers.items())
+
+    sim64 = Simulation(300, dtype=np.float64)
+    sim64.step(0.01)
+    assert all(getattr(sim64, name).dtype == np.float64 for name, _ in PARTICULE_FIELDS)
+
+
+def test_params():
+    params = make_params(gravity=10)
+    assert params_to_dict(params)["gravity"] == 10
+    assert params_to_dict(params)["target_density"] == TARGET_DENSITY
+    try:
+        make_params(gravty=10)
+        assert False
+    except KeyError:
+        pass
+
+    sim = Simulation(900, "grid")
+    pressures = sim.pressures.copy()
+    signatures = len(compute_forces.signatures)
+
+    # NOTE: changed values take effect on the next call, without recompiling
+    sim.params["factor_pressure"] *= 2
+    sim.update_forces()
+    assert np.allclose(sim.pressures, pressures * 2, rtol=1e-4, atol=1e-3)
+    assert len(compute_forces.signatures) == signatures
+
+    sim.params["smoothing_radius"] = SMOOTHING_RADIUS * 2
+    sim.step(0.01)
+    assert sim.cell_radius == SMOOTHING_RADIUS * 2
+    assert sim.cell_start.shape[0] == sim.grid_shape[0] * sim.grid_shape[1] +1
+    assert np.all(np.isfinite(sim.positions))
+
+
+def test_compile_cache():
+    import filter, liquid, neighbors, params, render, solver
+    from numba.core.caching import NullCache
+    from numba.core.registry import CPUDispatcher
+
+    for module in (filter, liquid, neighbors, params, render, solver):
+        for name, value in vars(module).items():
+            if isinstance(value, CPUDispatcher) and value.__module__ == module.__name__:
+                assert not isinstance(value._cache, NullCache), f"{module.__name__}.{name}"
+
+    assert warm_up() >= 0
+    assert len(compute_forces.signatures) > 0
+
+    # NOTE: only the kernel sources key the cache, and the old folders are removed
+    import kernel_cache
+    assert "test" not in kernel_cache.KERNEL_MODULES and "main" not in kernel_cache.KERNEL_MODULES
+    folders = list((kernel_cache.ROOT / "__pycache__").glob("numba-*"))
+    assert [folder.name for folder in folders] == [f"numba-{kernel_cache.cache_key()}"]
+
+
+def test_sweep():
+    grid = parse_grid(["gravity=0,10", "factor_pressure=2"])
+    assert grid == {"gravity": [0, 10], "factor_pressure": [2]}
+    assert expand_grid(grid) == [{"gravity": 0, "factor_pressure": 2}, {"gravity": 10, "factor_pressure": 2}]
+    try:
+        parse_grid(["gravty=1"])
+        assert False
+    except ValueError:
+        pass
+
+    assert split_cores(4, cores=8) == (4, min(2, numba.config.NUMBA_NUM_THREADS))
+    assert split_cores(16, cores=8)[0] == 8
+
+    stable = run_one({"gravity": 10}, 300, 20, 1/120, "random")
+    assert stable["stable"] and stable["density_error"] >= 0 and stable["kinetic_energy"] > 0
+    exploded = run_one({"factor_pressure": 1e6}, 300, 20, 1/120, "random")
+    assert not exploded["stable"] and exploded["unstable_at"] is not None
+
+
+def test_recorder():
+    import tempfile
+    sim = Simulation(300)
+    path = tempfile.mkdtemp()
+
+    positions, times = [], []
+    with TrajectoryRecorder(path, sim.n_parts, 8, ("positions", "densities")) as rec:
+        for _ in range(10):
+            sim.step(0.01)
+            if rec.record(sim):
+                positions.append(sim.positions.copy())
+                times.append(sim.time)
+            # NOTE: let the writer catch up, so that no frame is dropped
+            while rec.free.qsize() < 2 and not rec.is_full:
+                sleep(0.001)
+
+    traj = Trajectory(path)
+    assert len(traj) == len(positions) == 8 and rec.dropped == 0
+    assert np.array_equal(traj.frame(3)["positions"], positions[3])
+    assert traj.frame(3)["densities"].shape == (300,)
+    assert traj.frame_at(times[4] + 0.001) == 4 and traj.frame_at(-1) == 0
+
+    # NOTE: a recording left open still plays back what was written, and
+    # nothing of the previous one in the same folder
+    rec = TrajectoryRecorder(path, sim.n_parts, 8)
+    rec.record(sim)
+    while rec.free.qsize() < 2:
+        sleep(0.001)
+    traj = Trajectory(path)
+    assert len(traj) == 1 and traj.fields == ("positions",)
+    rec.close()
+
+    try:
+        TrajectoryRecorder(path, sim.n_parts, 8, ("densities",))
+        assert False
+    except ValueError:
+        pass
+
+
+def test_checkpoint():
+    import tempfile
+    path = tempfile.mktemp(suffix=".sph")
+
+    assert np.array_equal(Simulation(300, "random", seed=4).positions, Simulation(300, "random", seed=4).positions)
+
+    sim = Simulation(300, "random", seed=4, params=make_params(gravity=10))
+    for _ in range(10):
+        sim.step(0.01)
+    save_checkpoint(sim, path)
+
+    loaded = load_simulation(path)
+    assert loaded.time == sim.time and loaded.params["gravity"] == 10
+    assert np.array_equal(loaded.positions, sim.positions)
+    assert np.array_equal(loaded.densities, sim.densities)
+
+    # NOTE: both continue the same way, RNG included
+    for _ in range(5):
+        sim.step(0.01)
+        loaded.step(0.01)
+    assert np.array_equal(loaded.positions, sim.positions)
+    sim.reset()
+    loaded.reset()
+    assert np.array_equal(loaded.positions, sim.positions)
+
+    other = Simulation(300, "grid")
+    restore_checkpoint(other, path)
+    assert np.isclose(other.time, 0.1) and other.params["gravity"] == 10
+    try:
+        restore_checkpoint(Simulation(100), path)
+        assert False
+    except ValueError:
+        pass
+
+
+def test_pipeline():
+    sim = Simulation(500)
+    runner = SimulationThread(sim, FixedStepScheduler())
+    runner.start()
+    runner.set_mouse((500, 300), FACTOR_MOUSE, 50)
+    runner.set_running(True)
+    while runner.published < 5:
+        sleep(0.01)
+
+    with runner.read() as frame:
+        positions = frame.positions.copy()
+        sleep(0.1)
+        # NOTE: the frame being read is never overwritten
+        assert np.array_equal(frame.positions, positions)
+        frame.update_index()
+        assert frame.cell_start[-1] == sim.n_parts
+    assert sim.mouse_value == FACTOR_MOUSE
+
+    runner.set_running(False)
+    with runner.paused() as paused:
+        paused.reset()
+        assert paused.time == 0
+    with runner.read() as frame:
+        assert frame.time == 0 and np.array_equal(frame.positions, sim.positions)
+
+    runner.stop()
+    assert not runner.thread.is_alive()
+    assert np.all(np.isfinite(sim.positions))
+
+
+def test_layouts():
+    left, top = TANK[0] + LAYOUT_MARGIN, TANK[1] + LAYOUT_MARGIN
+    right, bottom = TANK[0] + TANK[2] - LAYOUT_MARGIN, TANK[1] + TANK[3] - LAYOUT_MARGIN
+
+    for mode in LAYOUTS:
+        for num in (10, 4_500, 200_000):
+            positions = create_particules(num, mode, np.random.default_rng(3))
+            assert positions.shape == (num, 2)
+            assert np.all(positions >= (left, top)) and np.all(positions <= (right, bottom)), (mode, num)
+            assert np.array_equal(positions, create_particules(num, mode, np.random.default_rng(3)))
+
+    # NOTE: the grids keep their spacing while it fits, and never overlap
+    grid = create_particules(4_500, "grid")
+    assert np.allclose(np.unique(np.diff(np.unique(grid[:, 0]))), round(RADIUS * 2.5))
+    cols, rows, spacing = fit_grid(200_000, right - left, bottom - top, round(RADIUS * 2.5))
+    assert cols * rows >= 200_000 and rows * spacing <= bottom - top
+
+    dam = create_particules(4_500, "dam_break")
+    assert dam[:, 0].max() <= left + (right - left) * DAM_WIDTH
+    assert dam[:, 1].max() > CENTER_TANK.y
+
+    try:
+        create_particules(10, "spiral")
+        assert False
+    except ValueError:
+        pass
+
+
+def test_pair_forces():
+    for neighbor_mode in NEIGHBOR_MODES:
+        gather = Simulation(2_000, "jittered", neighbor_mode, dtype=np.float64, seed=1)
+        pairs = Simulation(2_000, "jittered", neighbor_mode, dtype=np.float64, seed=1, force_mode="pairs")
+        assert pairs.pair_buffers.dtype == pairs.dtype and len(pairs.pair_buffers) <= PAIR_CHUNKS
+        # NOTE: more chunks than threads, to go through the chunk boundaries
+        pairs.pair_buffers = np.zeros((3, pairs.n_parts, 4))
+
+        for _ in range(5):
+            gather.step(0.01)
+            pairs.step(0.01)
+            assert np.allclose(pairs.pressures, gather.pressures, rtol=1e-6, atol=1e-6)
+            assert np.allclose(pairs.viscosities, gather.viscosities, rtol=1e-6, atol=1e-6)
+
+        # NOTE: equal and opposite, the internal forces sum to zero
+        assert np.allclose(pairs.pair_buffers.sum(axis=(0, 1))[2:], 0, atol=1e-6)
+
+
+def test_reorder():
+    for neighbor_mode in NEIGHBOR_MODES:
+        plain = Simulation(2_000, "random", neighbor_mode, dtype=np.float64, seed=2)
+        sorted_ = Simulation(2_000, "random", neighbor_mode, dtype=np.float64, seed=2, reorder_every=2)
+
+        for _ in range(6):
+            plain.step(0.01)
+            sorted_.step(0.01)
+        # NOTE: same particules, only the summation order changed
+        assert np.allclose(sorted_.by_id("positions"), plain.positions, rtol=1e-6, atol=1e-6)
+        assert np.allclose(sorted_.by_id("densities"), plain.densities, rtol=1e-6, atol=1e-6)
+
+        assert sorted(sorted_.ids) == list(range(2_000))
+        assert np.all(np.diff(sorted_.cell_keys) >= 0)
+        # NOTE: the index of a reorder step is the one of `pred_pos`, as the overlays read it
+        sorted_.pred_pos[:] = sorted_.positions + sorted_.cell_radius
+        sorted_.reorder()
+        keys = np.zeros_like(sorted_.cell_keys)
+        positions_to_cell(sorted_.pred_pos, keys, *sorted_.grid_shape, sorted_.cell_radius)
+        assert np.array_equal(keys, sorted_.cell_keys)
+
+    # NOTE: the reordering only writes into preallocated buffers
+    import tracemalloc
+    sim = Simulation(20_000, "random")
+    sim.reorder()
+    tracemalloc.start()
+    sim.reorder()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert peak < 20_000 * 4
+
+
+def test_kernel_table():
+    table = make_gradient_table(1024)
+    assert table_error(table)["max"] < 1e-3
+
+    analytic = Simulation(2_000, "jittered", dtype=np.float64, seed=3)
+    tabled = Simulation(2_000, "jittered", dtype=np.float64, seed=3, kernel_table=1024)
+    for _ in range(5):
+        analytic.step(0.01)
+        tabled.step(0.01)
+    scale = np.abs(analytic.pressures).max()
+    assert np.abs(tabled.pressures - analytic.pressures).max() < 1e-3 * scale
+    assert np.allclose(tabled.viscosities, analytic.viscosities, rtol=1e-6, atol=1e-6)
+
+    try:
+        Simulation(100, neighbor_mode="verlet", kernel_table=1024)
+        assert False, "kernel_table needs the grid gather passes"
+    except ValueError:
+        pass
+
+
+def test_mouse_force():
+    dt = 0.01
+    for neighbor_mode in NEIGHBOR_MODES:
+        sim = Simulation(5_000, "jittered", neighbor_mode, dtype=np.float64, seed=4)
+        sim.step(dt)
+        sim.mouse_pos[0] = CENTER_TANK_NUMPY[0]
+        sim.mouse_value = FACTOR_MOUSE
+        sim.mouse_radius = 60
+
+        force = calculate_mouse_force(sim.mouse_pos, sim.pred_pos, sim.velocities, sim.mouse_radius, sim.mouse_value)
+        expected = sim.velocities + force * dt / sim.densities.reshape((-1, 1))
+        sim.update_mouse_force(dt)
+        assert np.allclose(sim.velocities, expected)
+        assert sim.mouse_count == np.count_nonzero(np.any(force != 0, axis=1))
+
+
+def test_implicit_pressure():
+    values = {"gravity": 100}
+    explicit = Simulation(2_000, "dam_break", params=make_params(**values), seed=5)
+    implicit = Simulation(2_000, "dam_break", params=make_params(**values), seed=5, pressure_mode="implicit")
+    target = implicit.params[0]["target_density"]
+
+    dt = 1 / 60
+    for _ in range(60):
+        explicit.step(dt)
+        implicit.step(dt)
+        assert implicit.solver_error <= implicit.tolerance or implicit.solver_iterations == implicit.max_iterations
+        assert max_speed(implicit.velocities) * dt <= CFL_NUMBER * SMOOTHING_RADIUS * 1.001
+
+    assert np.all(np.isfinite(implicit.positions))
+    compression = lambda sim: np.mean(np.maximum(sim.densities - target, 0)) / target
+    assert compression(implicit) < compression(explicit) / 4
+    assert not np.any(implicit.pressures)
+
+    try:
+        Simulation(100, force_mode="pairs", pressure_mode="implicit")
+        assert False, "the implicit pressure needs the grid gather passes"
+    except ValueError:
+        pass
+
+
+def test_sleep():
+    dt = 1 / 120
+    sim = Simulation(4_500, "grid", seed=6, sleep_steps=30)
+    # NOTE: spaced out to about the target density, the inside settles at once
+    sim.positions[:] = create_particules(4_500, "grid", sim.rng, spacing=6.5)
+    for _ in range(120):
+        sim.step(dt)
+    assert sim.tracker.active_fraction < 0.5
+
+    positions = sim.positions.copy()
+    sim.step(dt)
+    asleep = ~sim.tracker.active
+    assert np.all(sim.positions[asleep] == positions[asleep])
+    assert not np.any(sim.velocities[asleep])
+
+    # NOTE: the brush wakes the cells it covers
+    sim.mouse_pos[0] = sim.positions[np.argmax(asleep)]
+    sim.mouse_value = FACTOR_MOUSE
+    sim.step(dt)
+    near = np.hypot(*(sim.positions - sim.mouse_pos).T) < sim.mouse_radius
+    assert np.all(sim.tracker.active[near])
+
+    # NOTE: the awake particules next to sleeping ones feel the forces of a full pass
+    sim.mouse_value = 0
+    for _ in range(30):
+        sim.step(dt)
+    active, density_active = sim.tracker.active, sim.tracker.density_active
+    assert np.any(active) and np.any(density_active & ~active)
+
+    # NOTE: the pressure forces of the last step against a full pass on its positions
+    state = (sim.cell_keys, sim.cell_order, sim.cell_start, *sim.grid_shape, sim.params)
+    densities = np.zeros_like(sim.densities)
+    pressures, viscosities = np.zeros_like(sim.pressures), np.zeros_like(sim.viscosities)
+    compute_densities(sim.pred_pos, *state, densities)
+    compute_forces(sim.pred_pos, sim.velocities, densities, *state, pressures, viscosities)
+    assert np.allclose(sim.pressures[active], pressures[active], rtol=1e-4, atol=1e-3)
+
+    # NOTE: a restored checkpoint wakes up, as a simulation loaded from it
+    import tempfile
+    path = tempfile.mktemp(suffix=".sph")
+    sim = Simulation(4_500, "grid", seed=6, sleep_steps=30)
+    sim.positions[:] = create_particules(4_500, "grid", sim.rng, spacing=6.5)
+    for _ in range(10):
+        sim.step(dt)
+    save_checkpoint(sim, path)
+    for _ in range(120):
+        sim.step(dt)
+    restore_checkpoint(sim, path)
+    loaded = load_simulation(path, sleep_steps=30)
+    for _ in range(5):
+        sim.step(dt)
+        loaded.step(dt)
+    assert sim.tracker.active_fraction == loaded.tracker.active_fraction == 1.0
+    assert np.array_equal(sim.positions, loaded.positions)
+
+    try:
+        Simulation(100, neighbor_mode="verlet", sleep_steps=30)
+        assert False, "sleeping needs the grid gather passes"
+    except ValueError:
+        pass
+
+
+def test_obstacles():
+    shapes = parse_shapes("""
+        container box 20 100 1060 480  # the tank
+        circle 400 400 50
+        box 600 300 40 100
+        polygon 800 500 900 500 850 400
+    """)
+    assert [(kind, container) for kind, container, _ in shapes] == [
+        ("box", True), ("circle", False), ("box", False), ("polygon", False)
+    ]
+    try:
+        parse_shapes("circle 1 2")
+        assert False, "a circle needs 3 values"
+    except ValueError:
+        pass
+
+    points = np.array([[400, 400], [400, 460], [850, 480], [850, 390]], dtype=np.float64)
+    assert np.allclose(shape_distance("circle", shapes[1][2], points[:2]), [-50, 10])
+    assert shape_distance("polygon", shapes[3][2], points[2:3])[0] < 0
+    assert np.isclose(shape_distance("polygon", shapes[3][2], points[3:])[0], 10)
+    assert np.isclose(shape_distance("box", shapes[2][2], np.array([[620.0, 290.0]]))[0], 10)
+
+    # NOTE: no shapes is the TANK, as tank_collision
+    field = ObstacleField([])
+    assert field.solid_mask()[0, 0] and not field.solid_mask()[100, 100]
+
+    field = ObstacleField(shapes)
+    sim = Simulation(3_000, "random", seed=7, obstacles=field)
+    for _ in range(60):
+        sim.step(1 / 120)
+    x, y = sim.positions.T.astype(np.float64)
+    for kind, _, values in shapes[1:]:
+        assert shape_distance(kind, values, np.stack((x, y), axis=-1)).min() > 0
+    assert np.all((x > TANK[0]) & (x < TANK[0] + TANK[2]) & (y > TANK[1]) & (y < TANK[1] + TANK[3]))
+
+    # NOTE: a ramp against the wall of the tank pushes out of its slope, not into the wall
+    ramp = ObstacleField(parse_shapes("polygon 20 380 300 580 20 580"))
+    positions = np.array([[23.0, 480.0]])
+    sdf_collision(positions, np.zeros((1, 2)), ramp.distance, ramp.gradient, ramp.cell, RADIUS)
+    assert positions[0, 0] > 23 and positions[0, 1] < 480
+
+    # NOTE: reflected with the same restitution as the walls of the tank
+    positions = np.array([[400.0, 449.0]])
+    velocities = np.array([[0.0, -10.0]])
+    sdf_collision(positions, velocities, field.distance, field.gradient, field.cell, RADIUS)
+    assert np.hypot(*(positions[0] - 400)) > 50 + RADIUS - 0.5
+    assert np.allclose(velocities[0], [0, 7], atol=0.5)
+
+
+# NOTE: neighbor lookup for all particules, per step (linear scan -> cell index)
+# N=1000 ~ 5ms -> 2ms | N=4500 ~ 65ms -> 11ms | N=10000 ~ 285ms -> 23ms
+def time_neighbors():
+    nx, ny = get_grid_shape()
+    for num in (1_000, 4_500, 10_000):
+        positions = create_particules(num)
+        keys = np.zeros(num, dtype=np.int64)
+        order = np.zeros(num, dtype=np.int64)
+        cell_start = np.zeros(nx * ny +1, dtype=np.int64)
+
+        start = time()
+        hashes = positions_to_hash(positions)
+        for i in range(num):
+            _ = get_indices(hashes[i], hashes)
+        linear = time() - start
+
+        start = time()
+        positions_to_cell(positions, keys, nx, ny)
+        build_cell_index(keys, order, cell_start)
+        for i in range(num):
+            _ = get_neighbor_indices(keys[i], order, cell_start, nx, ny)
+        indexed = time() - start
+
+        print(f'N={num}: linear scan {linear*1000:.0f}ms - cell index {indexed*1000:.0f}ms per step')
+
+
 # test_density()
-# time_density()
 # test_pressure()
-    
-test_filter()
\ No newline at end of file
+# time_neighbors()
+
+if __name__ == "__main__":
+    test_filter()
+    test_cell_index()
+    test_solver()
+    test_simulation()
+    test_profiler()
+    test_render()
+    test_density_field()
+    test_pressure_arrows()
+    test_verlet_lists()
+    test_scheduler()
+    test_no_allocations()
+    test_params()
+    test_compile_cache()
+    test_sweep()
+    test_recorder()
+    test_checkpoint()
+    test_pipeline()
+    test_layouts()
+    test_pair_forces()
+    test_reorder()
+    test_kernel_table()
+    test_mouse_force()
+    test_implicit_pressure()
+    test_sleep()
+    test_obstacles()
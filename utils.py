@@ -1,26 +1,26 @@
 from constants import *
 import numpy as np
-from numba import njit, jit
+from numba import njit, jit, prange
+import kernel_cache # NOTE: sets the cache folder, before the first @njit
 from pygame import Color, draw
 
-@njit
+@njit(parallel=True, nogil=True, cache=True)
 def tank_collision(pos: np.ndarray, vel: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """In place, returns the same arrays."""
+    cx, cy = CENTER_TANK_NUMPY[0, 0], CENTER_TANK_NUMPY[0, 1]
+    half_w, half_h = TANK[2]/2, TANK[3]/2
 
-    ref = pos - CENTER_TANK_NUMPY
-    cond_x = np.abs(ref[:, 0]) +RADIUS >= TANK[2]/2
-    cond_y = np.abs(ref[:, 1]) +RADIUS >= TANK[3]/2
+    for i in prange(pos.shape[0]):
+        ref_x = pos[i, 0] - cx
+        ref_y = pos[i, 1] - cy
 
-    pos[:, 0] = np.where(cond_x,
-        CENTER_TANK_NUMPY[0, 0] +(TANK[2]/2 -RADIUS -0.1) * np.sign(ref[:, 0]),
-        pos[:, 0]
-    )
-    vel[:, 0] = np.where(cond_x, vel[:, 0] * (-0.7), vel[:, 0])
+        if abs(ref_x) +RADIUS >= half_w:
+            pos[i, 0] = cx +(half_w -RADIUS -0.1) * np.sign(ref_x)
+            vel[i, 0] = vel[i, 0] * (-0.7)
 
-    pos[:, 1] = np.where(cond_y,
-        CENTER_TANK_NUMPY[0, 1] +(TANK[3]/2 -RADIUS -0.1) * np.sign(ref[:, 1]),
-        pos[:, 1]
-    )
-    vel[:, 1] = np.where(cond_y, vel[:, 1] * (-0.7), vel[:, 1])
+        if abs(ref_y) +RADIUS >= half_h:
+            pos[i, 1] = cy +(half_h -RADIUS -0.1) * np.sign(ref_y)
+            vel[i, 1] = vel[i, 1] * (-0.7)
 
     return pos, vel
 